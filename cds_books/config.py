@@ -22,6 +22,7 @@ from invenio_app_ils.config import RECORDS_REST_ENDPOINTS
 from invenio_app_ils.pidstore.pids import PATRON_PID_TYPE
 
 from .patrons.api import Patron
+from .patrons.indexer import PatronIndexer
 from .patrons.permissions import views_permissions_factory
 
 
@@ -142,6 +143,15 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'invenio_accounts.tasks.clean_session_table',
         'schedule': timedelta(minutes=60),
     },
+    # Incremental ldap users sync, the syncs never overlap as they hold a
+    # lock. To turn it off, e.g. when running the ``scripts/ldap_sync`` cron
+    # job instead, override CELERY_BEAT_SCHEDULE without this entry in the
+    # instance configuration.
+    'ldap-users-sync': {
+        'task': 'cds_books.ldap.tasks.sync_users',
+        'schedule': timedelta(hours=1),
+        'kwargs': {'incremental': True},
+    },
 }
 
 # Database
@@ -220,17 +230,62 @@ except Exception:
 # LDAP configuration
 # ======
 CDS_BOOKS_LDAP_URL = "ldap://xldap.cern.ch"
+#: Number of entries requested per page when exporting ldap accounts.
+CDS_BOOKS_LDAP_PAGE_SIZE = 1000
+#: Number of users inserted per statement when importing ldap accounts.
+CDS_BOOKS_LDAP_IMPORT_BATCH_SIZE = 1000
+#: Number of values combined in one OR filter by the batch ldap lookups.
+CDS_BOOKS_LDAP_BATCH_CHUNK_SIZE = 100
+#: ``employeeID`` prefixes splitting the full ldap export in searches run
+#: concurrently on the pooled connections, an empty list disables it.
+CDS_BOOKS_LDAP_EXPORT_PARTITIONS = [str(digit) for digit in range(10)]
+#: Maximum number of pooled ldap connections per process.
+CDS_BOOKS_LDAP_POOL_SIZE = 4
+#: Seconds to wait for the ldap server to accept a connection.
+CDS_BOOKS_LDAP_NETWORK_TIMEOUT = 10
+#: Seconds to wait for an ldap operation or a free pooled connection.
+CDS_BOOKS_LDAP_TIMEOUT = 60
+#: Number of reconnection attempts after a server disconnect.
+CDS_BOOKS_LDAP_RETRY_MAX = 3
+#: Seconds between reconnection attempts.
+CDS_BOOKS_LDAP_RETRY_DELAY = 1.0
+#: Callable, or import path of a callable, creating the ldap connections
+#: (defaults to ``ldap.ldapobject.ReconnectLDAPObject``).
+CDS_BOOKS_LDAP_CONNECTION_FACTORY = None
+#: Expiration of the lock held by a running ldap synchronization, in case its
+#: process dies without releasing it. The lock, the synchronization state and
+#: the snapshot of the synchronized accounts are kept in the cache shared by
+#: all the hosts, the last two without expiration.
+CDS_BOOKS_LDAP_SYNC_LOCK_TIMEOUT = timedelta(hours=6)
+#: A sync aborts without any change when more than this fraction of the
+#: synchronized users would be deactivated, e.g. after a partial ldap export.
+CDS_BOOKS_LDAP_MAX_DEACTIVATION_RATIO = 0.05
+#: Number of users applied by each task of the asynchronous ldap sync.
+CDS_BOOKS_LDAP_TASK_CHUNK_SIZE = 1000
+#: Incremental synchronizations fall back to a full sweep, detecting removed
+#: accounts, when the last one is older than this interval.
+CDS_BOOKS_LDAP_FULL_SYNC_INTERVAL = timedelta(days=1)
+#: Overlap of incremental synchronizations with the previous run.
+CDS_BOOKS_LDAP_SYNC_OVERLAP = timedelta(minutes=5)
 
 
 # RECORDS REST
 # ============
 
 RECORDS_REST_ENDPOINTS[PATRON_PID_TYPE]["record_class"] = Patron
+RECORDS_REST_ENDPOINTS[PATRON_PID_TYPE]["indexer_class"] = PatronIndexer
 
 # ILS
 # ==========
 ILS_VIEWS_PERMISSIONS_FACTORY = views_permissions_factory
 
+# Patrons
+# =======
+#: Seconds after which the cached locations are loaded again.
+CDS_BOOKS_LOCATIONS_CACHE_TTL = 3600
+#: Seconds during which a patron resolved from its person id is cached.
+CDS_BOOKS_PATRON_CACHE_TTL = 300
+
 # Migrator configuration
 # ======
 MIGRATOR_RECORDS_DUMPLOADER_CLS = \
@@ -9,6 +9,12 @@
 """CDS Books ldap API."""
 
 import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import ldap
 from flask import current_app
@@ -16,21 +22,95 @@ from invenio_accounts.models import User
 from invenio_db import db
 from invenio_oauthclient.models import RemoteAccount, UserIdentity
 from invenio_userprofiles.models import UserProfile
+from ldap.filter import escape_filter_chars
+from sqlalchemy.dialects import postgresql
+
+from ..patrons.api import get_client_id
+from .pool import get_pool
+from .sync import ldap_timestamp
+
+DEACTIVATED_IDENTITY_METHOD = 'cern-deactivated'
+"""Method of the ``cern`` identities of the deactivated users."""
+
+
+class LdapUser(object):
+    """Decoded ldap account.
+
+    Ldap entries are dictionaries of lists of bytes, e.g.:
+        {'displayName': [b'Joe Foe'],
+         'department': [b'IT/CDA'],
+         'uidNumber': [b'100000'],
+         'mail': [b'joe.foe@cern.ch'],
+         'cernAccountType': [b'Primary'],
+         'employeeID': [b'101010']
+        }
+
+    Each field is decoded once, when the entry is received, and the values
+    shared by many accounts are interned.
+    """
+
+    __slots__ = (
+        'person_id',
+        'mail',
+        'display_name',
+        'department',
+        'uid_number',
+        'account_type',
+    )
+
+    def __init__(self, person_id, mail, display_name, department, uid_number,
+                 account_type='Primary'):
+        """Constructor."""
+        self.person_id = person_id
+        self.mail = mail
+        self.display_name = display_name
+        self.department = department
+        self.uid_number = uid_number
+        self.account_type = account_type
+
+    @classmethod
+    def from_entry(cls, entry):
+        """Decode an ldap entry."""
+        def value(name, intern=False):
+            values = entry.get(name)
+            if not values:
+                return None
+            decoded = values[0].decode("utf8")
+            return sys.intern(decoded) if intern else decoded
+
+        return cls(
+            person_id=value('employeeID'),
+            mail=value('mail'),
+            display_name=value('displayName'),
+            department=value('department', intern=True),
+            uid_number=value('uidNumber'),
+            account_type=value('cernAccountType', intern=True),
+        )
+
+    def to_dict(self):
+        """Return the fields as a dictionary."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        """Compare all the fields."""
+        return isinstance(other, LdapUser) and \
+            self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        """Hash all the fields."""
+        return hash(tuple(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self):
+        """Represent the account by its person id."""
+        return '<LdapUser {}>'.format(self.person_id)
 
 
 class LdapClient(object):
     """Ldap client class for user importation/synchronization.
 
-    Response example:
-        [
-            {'displayName': [b'Joe Foe'],
-             'department': [b'IT/CDA'],
-             'uidNumber': [b'100000'],
-             'mail': [b'joe.foe@cern.ch'],
-             'cernAccountType': [b'Primary'],
-             'employeeID': [b'101010']
-            },...
-        ]
+    The accounts are returned as `LdapUser` instances. The accounts without
+    email cannot be imported, they are logged, counted in ``skipped`` and
+    left out.
     """
 
     LDAP_USER_RESP_FIELDS = [
@@ -42,102 +122,323 @@ class LdapClient(object):
         'uidNumber'
     ]
 
-    def __init__(self, ldap_url):
-        """Initialize ldap connection."""
-        self.ldap = ldap.initialize(ldap_url)
-
-    def get_primary_accounts(self):
-        """Retrieve all primary accounts from ldap."""
-        page_control = ldap.controls.SimplePagedResultsControl(
-                            True, size=1000, cookie='')
+    def __init__(self, ldap_url, page_size=None):
+        """Initialize ldap client using the pooled connections of the URL."""
+        self.ldap_url = ldap_url
+        self.pool = get_pool(ldap_url)
+        self.page_size = page_size or current_app.config.get(
+            "CDS_BOOKS_LDAP_PAGE_SIZE", 1000)
+        self.batch_chunk_size = current_app.config.get(
+            "CDS_BOOKS_LDAP_BATCH_CHUNK_SIZE", 100)
+        self.partitions = current_app.config.get(
+            "CDS_BOOKS_LDAP_EXPORT_PARTITIONS")
+        self.pages = 0
+        self.skipped = 0
+        self._pages_lock = threading.Lock()
 
-        response = self.ldap.search_ext(
+    def _search(self, connection, ldap_filter, serverctrls=None):
+        """Send a search of the entries matching the filter."""
+        return connection.search_ext(
             'OU=Users,OU=Organic Units,DC=cern,DC=ch',
             ldap.SCOPE_ONELEVEL,
-            '(&(cernAccountType=Primary))',
+            ldap_filter,
             self.LDAP_USER_RESP_FIELDS,
-            serverctrls=[page_control]
+            serverctrls=serverctrls
         )
 
-        result = []
-        pages = 0
-        while True:
-            pages += 1
-            rtype, rdata, rmsgid, serverctrls = self.ldap.result3(response)
-            result.extend([x[1] for x in rdata])
-            ldap_page_control = ldap.controls.SimplePagedResultsControl
-            ldap_page_control_type = ldap_page_control.controlType
-            controls = [control for control in serverctrls
-                        if control.controlType == ldap_page_control_type]
-            if not controls:
-                print('The server ignores RFC 2696 control')
-                break
-            if not controls[0].cookie:
-                break
-            page_control.cookie = controls[0].cookie
-            response = self.ldap.search_ext(
-                'OU=Users,OU=Organic Units,DC=cern,DC=ch',
-                ldap.SCOPE_ONELEVEL,
-                '(&(cernAccountType=Primary))',
-                self.LDAP_USER_RESP_FIELDS,
-                serverctrls=[page_control]
+    def _paged_search(self, ldap_filter):
+        """Yield all entries matching the filter, page by page.
+
+        Uses the RFC 2696 simple paged results control: the cookie returned
+        with each page is sent back to request the next one. The cookie is
+        bound to the connection, which is kept for the whole search. The
+        asynchronous searches are not retried by the connection itself: on
+        a server disconnect the connection is discarded and the search
+        restarts from the first page on a new one, skipping the entries
+        already yielded, at most ``retry_max`` times in a row.
+        """
+        page_control = ldap.controls.SimplePagedResultsControl(
+            True, size=self.page_size, cookie='')
+        ldap_page_control_type = \
+            ldap.controls.SimplePagedResultsControl.controlType
+        attempt = 0
+        yielded = set()
+        connection = self.pool.acquire()
+        try:
+            while True:
+                try:
+                    response = self._search(
+                        connection, ldap_filter, serverctrls=[page_control])
+                    rtype, rdata, rmsgid, serverctrls = connection.result3(
+                        response, timeout=self.pool.timeout)
+                except ldap.SERVER_DOWN:
+                    self.pool.discard(connection)
+                    connection = None
+                    attempt += 1
+                    if attempt > self.pool.retry_max:
+                        raise
+                    time.sleep(self.pool.retry_delay)
+                    connection = self.pool.acquire()
+                    page_control.cookie = ''
+                    continue
+                attempt = 0
+                with self._pages_lock:
+                    self.pages += 1
+                for dn, entry in rdata:
+                    if dn in yielded:
+                        continue
+                    yielded.add(dn)
+                    yield entry
+                controls = [control for control in serverctrls
+                            if control.controlType == ldap_page_control_type]
+                if not controls:
+                    print('The server ignores RFC 2696 control')
+                    break
+                if not controls[0].cookie:
+                    break
+                page_control.cookie = controls[0].cookie
+        finally:
+            if connection is not None:
+                self.pool.release(connection)
+
+    def _with_mail(self, ldap_users):
+        """Yield the accounts with an email, skipping the others."""
+        for ldap_user in ldap_users:
+            if ldap_user.mail:
+                yield ldap_user
+                continue
+            self.skipped += 1
+            current_app.logger.warning(
+                "Skipping ldap account %s without email", ldap_user.person_id)
+
+    def _search_all(self, ldap_filter):
+        """Return the entries of a single page search, retrying on errors."""
+        def search(connection):
+            response = self._search(
+                connection,
+                ldap_filter,
+                serverctrls=[ldap.controls.SimplePagedResultsControl(
+                    True, size=self.page_size, cookie='')]
             )
-        return result
+            return connection.result(response, timeout=self.pool.timeout)[1]
+        return [LdapUser.from_entry(x[1]) for x in self.pool.run(search)]
+
+    def _partitioned_search(self, ldap_filters):
+        """Yield the accounts matching several filters, searched in parallel.
+
+        Each filter is exported page by page on its own pooled connection.
+        The accounts are merged in a bounded queue, so that a slow consumer
+        pauses the exports, and are yielded once per person id.
+        """
+        results = queue.Queue(maxsize=self.page_size * len(ldap_filters))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def export(ldap_filter):
+            if stop.is_set():
+                return
+            entries = self._paged_search(ldap_filter)
+            try:
+                for entry in entries:
+                    if not put(LdapUser.from_entry(entry)):
+                        return
+            except Exception as exc:
+                put(exc)
+                return
+            finally:
+                entries.close()
+            put(done)
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.pool.size, len(ldap_filters)))
+        try:
+            for ldap_filter in ldap_filters:
+                executor.submit(export, ldap_filter)
+            seen = set()
+            pending = len(ldap_filters)
+            while pending:
+                item = results.get()
+                if item is done:
+                    pending -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif item.person_id not in seen:
+                    seen.add(item.person_id)
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def get_primary_accounts(self, modified_since=None, partitions=None):
+        """Yield all primary accounts from ldap, page by page.
+
+        :param modified_since: only yield the accounts modified since this
+            UTC datetime.
+        :param partitions: ``employeeID`` prefixes splitting the export in
+            disjoint searches run concurrently, defaults to
+            ``CDS_BOOKS_LDAP_EXPORT_PARTITIONS``. The accounts matching none
+            of the prefixes are exported by one more search.
+        """
+        ldap_filter = '(cernAccountType=Primary)'
+        if modified_since:
+            ldap_filter += '(modifyTimestamp>={})'.format(
+                ldap_timestamp(modified_since))
+        self.pages = 0
+        self.skipped = 0
+        if partitions is None:
+            partitions = self.partitions
+        if not partitions:
+            entries = self._paged_search('(&{})'.format(ldap_filter))
+            for ldap_user in self._with_mail(
+                    LdapUser.from_entry(entry) for entry in entries):
+                yield ldap_user
+            return
+
+        prefix_filters = [
+            '(employeeID={}*)'.format(escape_filter_chars(prefix))
+            for prefix in partitions
+        ]
+        ldap_filters = [
+            '(&{}{})'.format(ldap_filter, prefix_filter)
+            for prefix_filter in prefix_filters
+        ]
+        ldap_filters.append('(&{}(!(|{})))'.format(
+            ldap_filter, ''.join(prefix_filters)))
+        for ldap_user in self._with_mail(
+                self._partitioned_search(ldap_filters)):
+            yield ldap_user
 
     def get_user_by_person_id(self, person_id):
         """Query ldap to retrieve user by person id."""
-        self.ldap.search_ext(
-            'OU=Users,OU=Organic Units,DC=cern,DC=ch',
-            ldap.SCOPE_ONELEVEL,
-            '(&(cernAccountType=Primary)(employeeID={}))'.format(person_id),
-            self.LDAP_USER_RESP_FIELDS,
-            serverctrls=[ldap.controls.SimplePagedResultsControl(
-                True, size=7, cookie='')]
-        )
+        return list(self._with_mail(self._search_all(
+            '(&(cernAccountType=Primary)(employeeID={}))'.format(
+                escape_filter_chars(str(person_id))))))
 
-        res = self.ldap.result()[1]
+    def get_user_by_mail(self, mail):
+        """Query ldap to retrieve user by email."""
+        return list(self._with_mail(self._search_all(
+            '(&(cernAccountType=Primary)(mail={}))'.format(
+                escape_filter_chars(mail)))))
 
-        return [x[1] for x in res]
+    def _get_users_by_attribute(self, attribute, field, values):
+        """Query ldap in batches to retrieve users by an attribute value.
 
-    def get_user_by_mail(self, mail):
-        """Query ldap to retrieve user by person id."""
-        self.ldap.search_ext(
-            'OU=Users,OU=Organic Units,DC=cern,DC=ch',
-            ldap.SCOPE_ONELEVEL,
-            '(&(cernAccountType=Primary)(mail={}))'.format(mail),
-            self.LDAP_USER_RESP_FIELDS,
-            serverctrls=[ldap.controls.SimplePagedResultsControl(
-                True, size=7, cookie='')]
-        )
+        The values are split in chunks, each chunk is queried with a single
+        OR filter and the chunks run concurrently on the pooled connections.
+
+        :return: dictionary of input value to ldap user, ``None`` if no user
+            was found.
+        """
+        values = list(values)
+        chunks = [
+            values[start:start + self.batch_chunk_size]
+            for start in range(0, len(values), self.batch_chunk_size)
+        ]
+
+        def search_chunk(chunk):
+            ldap_filter = '(&(cernAccountType=Primary)(|{}))'.format(''.join(
+                '({}={})'.format(attribute, escape_filter_chars(str(value)))
+                for value in chunk
+            ))
+            return self._search_all(ldap_filter)
 
-        res = self.ldap.result()[1]
+        # Attribute values are matched case-insensitively by ldap
+        found = {}
+        with ThreadPoolExecutor(max_workers=self.pool.size) as pool:
+            for ldap_users in pool.map(search_chunk, chunks):
+                for ldap_user in self._with_mail(ldap_users):
+                    value = getattr(ldap_user, field)
+                    if value is not None:
+                        found[value.lower()] = ldap_user
+        return {value: found.get(str(value).lower()) for value in values}
 
-        return [x[1] for x in res]
+    def get_users_by_person_ids(self, person_ids):
+        """Query ldap to retrieve users by person ids, in batches."""
+        return self._get_users_by_attribute(
+            'employeeID', 'person_id', person_ids)
+
+    def get_users_by_mails(self, mails):
+        """Query ldap to retrieve users by emails, in batches."""
+        return self._get_users_by_attribute('mail', 'mail', mails)
 
 
 class LdapUserImporter():
     """Import ldap users to Invenio ILS records.
 
-    Expected input format for ldap users:
-        [
-            {'displayName': [b'Joe Foe'],
-             'department': [b'IT/CDA'],
-             'uidNumber': [b'100000'],
-             'mail': [b'joe.foe@cern.ch'],
-             'cernAccountType': [b'Primary'],
-             'employeeID': [b'101010']
-            },...
-        ]
+    Expected input: an iterable of `LdapUser`.
     """
 
-    def __init__(self, ldap_users):
+    def __init__(self, ldap_users, batch_size=None, verbose=True):
         """Constructor."""
         self.ldap_users = ldap_users
+        self.verbose = verbose
+        self.user_ids = []
+        self.batch_size = batch_size or current_app.config.get(
+            "CDS_BOOKS_LDAP_IMPORT_BATCH_SIZE", 1000)
+
+    @staticmethod
+    def exclude_existing(ldap_users, chunk_size=1000):
+        """Return the ldap users whose email is not used by a system user."""
+        existing = set()
+        emails = [ldap_user.mail for ldap_user in ldap_users]
+        for start in range(0, len(emails), chunk_size):
+            existing.update(
+                email for email, in db.session.query(User.email).filter(
+                    User.email.in_(emails[start:start + chunk_size])))
+        return [
+            ldap_user for ldap_user in ldap_users
+            if ldap_user.mail not in existing
+        ]
+
+    @staticmethod
+    def find_existing(ldap_users, chunk_size=1000):
+        """Return the system users of ldap accounts created elsewhere.
+
+        E.g. users logged in with SSO or imported after the last sync. The
+        accounts are matched by the person id stored in the remote accounts
+        or else by email.
+
+        :return: dictionary of person id to user id of the matched accounts.
+        """
+        person_ids = [ldap_user.person_id for ldap_user in ldap_users]
+        found = {}
+        remote_person_id = db.cast(
+            RemoteAccount.extra_data, postgresql.JSONB)["person_id"].astext
+        for start in range(0, len(person_ids), chunk_size):
+            rows = db.session.query(
+                RemoteAccount.user_id, remote_person_id
+            ).filter(
+                RemoteAccount.client_id == get_client_id(),
+                remote_person_id.in_(person_ids[start:start + chunk_size]),
+            )
+            for user_id, person_id in rows:
+                found[person_id] = user_id
+
+        person_ids_by_email = {
+            ldap_user.mail: ldap_user.person_id for ldap_user in ldap_users
+            if ldap_user.person_id not in found
+        }
+        emails = list(person_ids_by_email)
+        for start in range(0, len(emails), chunk_size):
+            rows = db.session.query(User.id, User.email).filter(
+                User.email.in_(emails[start:start + chunk_size]))
+            for user_id, email in rows:
+                found[person_ids_by_email[email]] = user_id
+        return found
 
     def import_user_identity(self, user_id, ldap_user):
         """Return new user identity entry."""
         return {
-            'id': ldap_user['uidNumber'][0].decode("utf8"),
+            'id': ldap_user.uid_number,
             'method': 'cern',
             'id_user': user_id,
         }
@@ -145,7 +446,7 @@ class LdapUserImporter():
     def import_user(self, user):
         """Return new user entry."""
         return {
-            'email': user['mail'][0].decode("utf8"),
+            'email': user.mail,
             'active': True,
         }
 
@@ -154,8 +455,8 @@ class LdapUserImporter():
         return {
             'user_id': user_id,
             'extra_data': {
-                'person_id': ldap_user['employeeID'][0].decode("utf8"),
-                'department': ldap_user['department'][0].decode("utf8")
+                'person_id': ldap_user.person_id,
+                'department': ldap_user.department
             }
         }
 
@@ -164,37 +465,346 @@ class LdapUserImporter():
         return {
             'user_id': user_id,
             '_displayname': 'id_' + str(user_id),
-            'full_name': ldap_user['displayName'][0].decode("utf8"),
+            'full_name': ldap_user.display_name,
         }
 
+    def import_users_batch(self, ldap_users, client_id):
+        """Bulk insert a batch of ldap users and return their ids in order.
+
+        The users are inserted with a single multi-row INSERT returning the
+        new ids, followed by one bulk insert for each of the identities,
+        profiles and remote accounts of the batch.
+        """
+        users = [self.import_user(ldap_user) for ldap_user in ldap_users]
+        user_table = User.__table__
+        rows = db.session.execute(
+            user_table.insert().values(users).returning(
+                user_table.c.id, user_table.c.email)
+        )
+        user_ids = {email: user_id for user_id, email in rows}
+
+        identities = []
+        profiles = []
+        remote_accounts = []
+        for ldap_user, user in zip(ldap_users, users):
+            user_id = user_ids[user['email']]
+            identities.append(self.import_user_identity(user_id, ldap_user))
+            profiles.append(self.import_user_profile(user_id, ldap_user))
+            remote_account = self.import_remote_account(user_id, ldap_user)
+            remote_account['client_id'] = client_id
+            remote_accounts.append(remote_account)
+
+        db.session.bulk_insert_mappings(UserIdentity, identities)
+        db.session.bulk_insert_mappings(UserProfile, profiles)
+        db.session.bulk_insert_mappings(RemoteAccount, remote_accounts)
+        return [user_ids[user['email']] for user in users]
+
     def import_users(self):
-        """Return location and internal location records."""
-        def _commit_user(user_data):
-            """Commit new user in db."""
-            user = User(**self.import_user(user_data))
-            db.session.add(user)
-            db.session.commit()
-            return user.id
+        """Import the ldap users and return how many were imported.
+
+        The ids of the created users are kept in ``user_ids``, in the order
+        of the imported ldap users.
+        """
+        client_id = get_client_id()
 
+        batch = []
         for ldap_user in self.ldap_users:
-            print("Importing user with person id {}".format(
-                ldap_user['employeeID'][0].decode("utf8")))
-
-            user_id = _commit_user(ldap_user)
-            identity = UserIdentity(
-                **self.import_user_identity(user_id, ldap_user))
-            db.session.add(identity)
-
-            profile = UserProfile(
-                **self.import_user_profile(user_id, ldap_user))
-            db.session.add(profile)
-
-            client_id = current_app.config.get(
-                "CERN_APP_CREDENTIALS", {}).get("consumer_key") or "CLIENT_ID"
-            remote_account = RemoteAccount(
-                                client_id=client_id,
-                                **self.import_remote_account(
-                                    user_id, ldap_user))
-            db.session.add(remote_account)
+            batch.append(ldap_user)
+            if len(batch) >= self.batch_size:
+                self.user_ids.extend(
+                    self.import_users_batch(batch, client_id))
+                db.session.commit()
+                if self.verbose:
+                    print("Imported {} users".format(len(self.user_ids)))
+                batch = []
+        if batch:
+            self.user_ids.extend(self.import_users_batch(batch, client_id))
+            db.session.commit()
+            if self.verbose:
+                print("Imported {} users".format(len(self.user_ids)))
+        return len(self.user_ids)
+
+
+class LdapUserUpdater():
+    """Apply ldap account changes to the system users.
+
+    Expected input: the ``updated`` list of an `LdapDiff`, i.e. tuples of
+    ``(user_id, LdapUser, changed fields)``. Only the rows of the changed
+    fields are written, with one bulk statement per table.
+    """
+
+    def __init__(self, updates, chunk_size=None):
+        """Constructor."""
+        self.updates = updates
+        self.chunk_size = chunk_size or current_app.config.get(
+            "CDS_BOOKS_LDAP_IMPORT_BATCH_SIZE", 1000)
+
+    def update_emails(self, updates):
+        """Update the email of the users."""
+        db.session.bulk_update_mappings(User, [
+            dict(id=user_id, email=ldap_user.mail)
+            for user_id, ldap_user in updates
+        ])
+
+    def update_profiles(self, updates):
+        """Update the full name of the user profiles.
+
+        The users created without a profile get one.
+        """
+        existing = {
+            user_id for user_id, in db.session.query(
+                UserProfile.user_id).filter(UserProfile.user_id.in_(
+                    [user_id for user_id, _ in updates]))
+        }
+        db.session.bulk_update_mappings(UserProfile, [
+            dict(user_id=user_id, full_name=ldap_user.display_name)
+            for user_id, ldap_user in updates if user_id in existing
+        ])
+        db.session.bulk_insert_mappings(UserProfile, [
+            dict(user_id=user_id, _displayname='id_' + str(user_id),
+                 full_name=ldap_user.display_name)
+            for user_id, ldap_user in updates if user_id not in existing
+        ])
+
+    def update_identities(self, updates):
+        """Update the ``cern`` identity of the users.
+
+        The identity id is part of the primary key, so the rows are updated
+        with a single executemany statement instead of the ORM. The users
+        created without a ``cern`` identity get one.
+        """
+        existing = {
+            user_id for user_id, in db.session.query(
+                UserIdentity.id_user).filter(
+                    UserIdentity.id_user.in_(
+                        [user_id for user_id, _ in updates]),
+                    UserIdentity.method == 'cern')
+        }
+        table = UserIdentity.__table__
+        params = [
+            dict(b_user_id=user_id, b_id=ldap_user.uid_number)
+            for user_id, ldap_user in updates if user_id in existing
+        ]
+        if params:
+            db.session.execute(
+                table.update().where(db.and_(
+                    table.c.id_user == db.bindparam('b_user_id'),
+                    table.c.method == 'cern',
+                )).values(id=db.bindparam('b_id')),
+                params
+            )
+        db.session.bulk_insert_mappings(UserIdentity, [
+            dict(id=ldap_user.uid_number, method='cern', id_user=user_id)
+            for user_id, ldap_user in updates if user_id not in existing
+        ])
+
+    def update_remote_accounts(self, updates):
+        """Update the person id and department of the remote accounts.
+
+        The users created without a CERN remote account get one.
+        """
+        ldap_users = {user_id: ldap_user for user_id, ldap_user in updates}
+        client_id = get_client_id()
+        rows = db.session.query(
+            RemoteAccount.id, RemoteAccount.user_id, RemoteAccount.extra_data
+        ).filter(
+            RemoteAccount.user_id.in_(list(ldap_users)),
+            RemoteAccount.client_id == client_id,
+        )
+        mappings = []
+        for remote_account_id, user_id, extra_data in rows:
+            ldap_user = ldap_users.pop(user_id)
+            extra_data = dict(extra_data or {})
+            extra_data["person_id"] = ldap_user.person_id
+            extra_data["department"] = ldap_user.department
+            mappings.append(dict(id=remote_account_id, extra_data=extra_data))
+        db.session.bulk_update_mappings(RemoteAccount, mappings)
+        db.session.bulk_insert_mappings(RemoteAccount, [
+            dict(user_id=user_id, client_id=client_id, extra_data=dict(
+                person_id=ldap_user.person_id,
+                department=ldap_user.department))
+            for user_id, ldap_user in ldap_users.items()
+        ])
+
+    def update_users(self):
+        """Apply the updates in a single transaction.
+
+        :return: the ids of the updated users.
+        """
+        writers = dict(
+            department=self.update_remote_accounts,
+            display_name=self.update_profiles,
+            mail=self.update_emails,
+            uid_number=self.update_identities,
+        )
+        by_field = {field: [] for field in writers}
+        for user_id, ldap_user, fields in self.updates:
+            for field in fields:
+                by_field[field].append((user_id, ldap_user))
+
+        for field, updates in by_field.items():
+            for start in range(0, len(updates), self.chunk_size):
+                writers[field](updates[start:start + self.chunk_size])
+        db.session.commit()
+        return [user_id for user_id, _, _ in self.updates]
+
+
+class LdapSyncAborted(Exception):
+    """Raised when a sync would deactivate too many users at once."""
+
+
+class LdapUserDeactivator():
+    """Deactivate the system users removed from ldap.
+
+    Expected input: the ids of the users to deactivate. The users are set
+    inactive, their remote account is marked with a ``deactivated_at`` date
+    and their ``cern`` identity is tombstoned, with bulk statements per
+    chunk. `LdapUserReactivator` reverts it.
+    """
+
+    def __init__(self, user_ids, chunk_size=None):
+        """Constructor."""
+        self.user_ids = list(user_ids)
+        self.chunk_size = chunk_size or current_app.config.get(
+            "CDS_BOOKS_LDAP_IMPORT_BATCH_SIZE", 1000)
+
+    @staticmethod
+    def check_ratio(removed, synchronized):
+        """Raise `LdapSyncAborted` when too many users would be deactivated.
+
+        :param removed: accounts removed from ldap.
+        :param synchronized: number of synchronized accounts.
+        """
+        max_ratio = current_app.config[
+            "CDS_BOOKS_LDAP_MAX_DEACTIVATION_RATIO"]
+        if synchronized and len(removed) > max_ratio * synchronized:
+            raise LdapSyncAborted(
+                "{} of the {} synchronized users are missing from ldap, more "
+                "than CDS_BOOKS_LDAP_MAX_DEACTIVATION_RATIO ({}).".format(
+                    len(removed), synchronized, max_ratio))
+
+    def deactivate_users(self, user_ids):
+        """Set the users inactive."""
+        db.session.query(User).filter(User.id.in_(user_ids)).update(
+            {User.active: False}, synchronize_session=False)
+
+    def tombstone_remote_accounts(self, user_ids, deactivated_at):
+        """Mark the remote accounts as deactivated."""
+        rows = db.session.query(
+            RemoteAccount.id, RemoteAccount.extra_data
+        ).filter(RemoteAccount.user_id.in_(user_ids))
+        mappings = []
+        for remote_account_id, extra_data in rows:
+            extra_data = dict(extra_data)
+            extra_data["deactivated_at"] = deactivated_at
+            mappings.append(dict(id=remote_account_id, extra_data=extra_data))
+        db.session.bulk_update_mappings(RemoteAccount, mappings)
+
+    def tombstone_identities(self, user_ids):
+        """Move the ``cern`` identities to `DEACTIVATED_IDENTITY_METHOD`.
+
+        Their ids can be reassigned to other users, while the link to the
+        user is kept. Older tombstones of the same ids are replaced.
+        """
+        ids = [
+            id for id, in db.session.query(UserIdentity.id).filter(
+                UserIdentity.id_user.in_(user_ids),
+                UserIdentity.method == 'cern')
+        ]
+        db.session.query(UserIdentity).filter(
+            UserIdentity.id.in_(ids),
+            UserIdentity.method == DEACTIVATED_IDENTITY_METHOD,
+        ).delete(synchronize_session=False)
+        db.session.query(UserIdentity).filter(
+            UserIdentity.id_user.in_(user_ids),
+            UserIdentity.method == 'cern',
+        ).update({UserIdentity.method: DEACTIVATED_IDENTITY_METHOD},
+                 synchronize_session=False)
+
+    def deactivate(self):
+        """Deactivate the users in a single transaction.
+
+        :return: the ids of the deactivated users.
+        """
+        deactivated_at = datetime.utcnow().isoformat()
+        for start in range(0, len(self.user_ids), self.chunk_size):
+            user_ids = self.user_ids[start:start + self.chunk_size]
+            self.deactivate_users(user_ids)
+            self.tombstone_remote_accounts(user_ids, deactivated_at)
+            self.tombstone_identities(user_ids)
+        db.session.commit()
+        return self.user_ids
+
+
+class LdapUserReactivator():
+    """Reactivate the users deactivated by a sync, back in ldap.
+
+    Expected input: the ids of existing users. Only the users deactivated by
+    `LdapUserDeactivator` are reactivated: they are set active, the
+    ``deactivated_at`` date is removed from their remote account and their
+    ``cern`` identity is restored, unless its id was reassigned meanwhile.
+    """
+
+    def __init__(self, user_ids):
+        """Constructor."""
+        self.user_ids = list(user_ids)
+
+    def restore_remote_accounts(self, user_ids):
+        """Remove the deactivation mark of the remote accounts.
+
+        :return: the ids of the users which were deactivated.
+        """
+        rows = db.session.query(
+            RemoteAccount.id, RemoteAccount.user_id, RemoteAccount.extra_data
+        ).filter(
+            RemoteAccount.user_id.in_(user_ids),
+            RemoteAccount.client_id == get_client_id(),
+        )
+        mappings = []
+        deactivated = []
+        for remote_account_id, user_id, extra_data in rows:
+            if not (extra_data or {}).get("deactivated_at"):
+                continue
+            extra_data = dict(extra_data)
+            del extra_data["deactivated_at"]
+            mappings.append(dict(id=remote_account_id, extra_data=extra_data))
+            deactivated.append(user_id)
+        db.session.bulk_update_mappings(RemoteAccount, mappings)
+        return deactivated
+
+    def restore_identities(self, user_ids):
+        """Move the tombstoned identities back to the ``cern`` method.
+
+        The tombstones whose id is used by another user are dropped, the
+        sync then creates the identity from ldap.
+        """
+        tombstones = db.session.query(UserIdentity.id).filter(
+            UserIdentity.id_user.in_(user_ids),
+            UserIdentity.method == DEACTIVATED_IDENTITY_METHOD,
+        )
+        ids = [id for id, in tombstones]
+        taken = [
+            id for id, in db.session.query(UserIdentity.id).filter(
+                UserIdentity.id.in_(ids), UserIdentity.method == 'cern')
+        ]
+        db.session.query(UserIdentity).filter(
+            UserIdentity.id.in_(taken),
+            UserIdentity.method == DEACTIVATED_IDENTITY_METHOD,
+        ).delete(synchronize_session=False)
+        db.session.query(UserIdentity).filter(
+            UserIdentity.id_user.in_(user_ids),
+            UserIdentity.method == DEACTIVATED_IDENTITY_METHOD,
+        ).update({UserIdentity.method: 'cern'}, synchronize_session=False)
+
+    def reactivate(self):
+        """Reactivate the users in a single transaction.
 
+        :return: the ids of the reactivated users.
+        """
+        user_ids = self.restore_remote_accounts(self.user_ids)
+        if user_ids:
+            db.session.query(User).filter(User.id.in_(user_ids)).update(
+                {User.active: True}, synchronize_session=False)
+            self.restore_identities(user_ids)
         db.session.commit()
+        return user_ids
@@ -10,53 +10,179 @@
 
 from __future__ import absolute_import, print_function
 
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
 import click
 from flask import current_app
 from flask.cli import with_appcontext
-from invenio_accounts.models import User
-from invenio_db import db
-from invenio_oauthclient.models import RemoteAccount
-from sqlalchemy.orm.exc import NoResultFound
 
-from .api import LdapClient, LdapUserImporter
+from ..patrons.indexer import bulk_delete_patrons, \
+    bulk_index_all_patrons, bulk_index_patrons
+from .api import LdapClient, LdapSyncAborted, LdapUserDeactivator, \
+    LdapUserImporter, LdapUserReactivator, LdapUserUpdater
+from .metrics import metrics
+from .snapshot import LdapSnapshot, adopt_existing_users, diff_ldap_users
+from .sync import LdapSyncLocked, LdapSyncState, acquire_sync_lock, \
+    release_sync_lock
+
 
+def echo_user(message, **styles):
+    """Report a change of one user, unless running quietly."""
+    if not metrics.quiet:
+        click.secho(message, **styles)
 
-def index_ldap_users():
-    """Index ldap users in ES."""
-    from invenio_base.app import create_cli
 
-    cli = create_cli()
-    runner = current_app.test_cli_runner()
-    command = "ils patrons index"
-    click.secho('ils {}...'.format(command), fg='green')
-    runner.invoke(cli, command, catch_exceptions=True)
+def index_ldap_users(user_ids):
+    """Index the patrons of the given ldap users in ES."""
+    if not user_ids:
+        return 0
+    echo_user('Indexing {} patrons...'.format(len(user_ids)), fg='green')
+    with metrics.timer('indexing'):
+        return bulk_index_patrons(user_ids)
 
 
 def import_ldap_users(ldap_users):
-    """Import ldap users in db."""
-    importer = LdapUserImporter(ldap_users)
-    importer.import_users()
-    click.secho('Now indexing...', fg='green')
-    index_ldap_users()
+    """Import ldap users in db and return the ids of the created users."""
+    importer = LdapUserImporter(ldap_users, verbose=not metrics.quiet)
+    with metrics.timer('db'):
+        importer.import_users()
+    metrics.count('added', len(importer.user_ids))
+    echo_user('Now indexing...', fg='green')
+    index_ldap_users(importer.user_ids)
+    return importer.user_ids
+
+
+def update_ldap_users(updates):
+    """Apply ldap account changes and return the ids of the updated users."""
+    for user_id, ldap_user, fields in updates:
+        echo_user("Changes detected for user {} in {}".format(
+            ldap_user.mail, ", ".join(fields)), fg="green")
+    with metrics.timer('db'):
+        user_ids = LdapUserUpdater(updates).update_users()
+    metrics.count('updated', len(user_ids))
+    index_ldap_users(user_ids)
+    return user_ids
+
+
+def match_existing_users(snapshot, diff):
+    """Diff the added accounts which already have a system user.
+
+    E.g. users logged in with SSO, imported after the last sync or
+    deactivated, matched by person id or email. The deactivated users are
+    reactivated and reindexed.
+    """
+    with metrics.timer('db'):
+        existing = LdapUserImporter.find_existing(diff.added)
+        reactivated = LdapUserReactivator(existing.values()).reactivate()
+        adopt_existing_users(snapshot, diff, existing)
+    metrics.count('reactivated', len(reactivated))
+    for user_id in reactivated:
+        echo_user("Reactivating user {}".format(user_id), fg="green")
+    # The updated users are reindexed with their changes
+    updated = set(user_id for user_id, _, _ in diff.updated)
+    index_ldap_users([
+        user_id for user_id in reactivated if user_id not in updated])
+    for ldap_user in diff.added:
+        echo_user("Adding new user {}".format(ldap_user.mail), fg="green")
+
+
+def fetch_ldap_users(ldap_client, **kwargs):
+    """Stream the primary accounts, timing the ldap round-trips."""
+    ldap_users = metrics.timed_iter(
+        'ldap_fetch',
+        ldap_client.get_primary_accounts(**kwargs),
+        counter='ldap_entries'
+    )
+    for ldap_user in ldap_users:
+        yield ldap_user
+    metrics.count('ldap_pages', ldap_client.pages)
+    metrics.count('skipped', ldap_client.skipped)
+
+
+@contextmanager
+def measured(command, quiet=False, metrics_report=None,
+             prometheus_textfile=None):
+    """Collect the metrics of the wrapped command and report them."""
+    metrics.reset(command)
+    metrics.quiet = quiet
+    try:
+        yield metrics
+        metrics.success = True
+    finally:
+        metrics.quiet = False
+        report = metrics.report()
+        if metrics_report:
+            json.dump(report, metrics_report, indent=2)
+        elif quiet:
+            click.echo(json.dumps(report))
+        else:
+            click.secho(
+                "--- Finished in %s seconds ---" % report['total_seconds'],
+                fg="green"
+            )
+        if prometheus_textfile:
+            metrics.write_prometheus(prometheus_textfile)
 
 
-def check_user_for_update(system_user, ldap_user):
-    """Check if there is an ldap update for a user and commit changes."""
-    ldap_user_department = ldap_user["department"][0].decode("utf8")
-    if not system_user.extra_data["department"] == ldap_user_department:
-        click.secho("Changes detected for system user {}".format(
-            str(system_user.user)), fg="green")
-        click.secho(
-            "System user's department {} is different than the {}".format(
-                system_user.extra_data["department"], ldap_user_department),
-            fg="green")
-        system_user.extra_data.update(dict(department=ldap_user_department))
-        db.session.commit()
+@contextmanager
+def locked():
+    """Hold the ldap synchronizations lock in the wrapped block."""
+    try:
+        token = acquire_sync_lock()
+    except LdapSyncLocked as e:
+        raise click.ClickException(str(e))
+    try:
+        yield
+    finally:
+        release_sync_lock(token)
 
 
-def delete_user(system_user):
-    """Delete a system user."""
-    pass
+def metrics_options(f):
+    """Add the quiet mode and metrics report options to a command."""
+    f = click.option(
+        '--prometheus-textfile',
+        type=click.Path(dir_okay=False, writable=True),
+        envvar='CDS_BOOKS_LDAP_PROMETHEUS_TEXTFILE',
+        help='Also write the metrics to this Prometheus textfile, e.g. in '
+             'the node exporter textfile collector directory.')(f)
+    f = click.option(
+        '--metrics-report',
+        type=click.File('w'),
+        help='Write the run metrics as JSON to this file.')(f)
+    return click.option(
+        '--quiet', '-q',
+        is_flag=True,
+        default=False,
+        help='Do not report each user, print the run metrics as JSON.')(f)
+
+
+def check_deactivation_ratio(removed, synchronized):
+    """Abort when too many users would be deactivated at once."""
+    try:
+        LdapUserDeactivator.check_ratio(removed, synchronized)
+    except LdapSyncAborted as e:
+        raise click.ClickException("{} Aborting the sync.".format(e))
+
+
+def deactivate_ldap_users(removed):
+    """Deactivate the users removed from ldap and unindex their patrons.
+
+    :param removed: ``(user_id, person_id)`` of the removed accounts.
+    :return: the ids of the deactivated users.
+    """
+    for user_id, person_id in removed:
+        echo_user("Deactivating user {} with ccid {}".format(
+            user_id, person_id), fg="red")
+    with metrics.timer('db'):
+        user_ids = LdapUserDeactivator(
+            user_id for user_id, _ in removed).deactivate()
+    metrics.count('removed', len(user_ids))
+    with metrics.timer('indexing'):
+        bulk_delete_patrons(
+            user_ids, person_ids=[person_id for _, person_id in removed])
+    return user_ids
 
 
 @click.group()
@@ -65,67 +191,94 @@ def ldap_users():
 
 
 @ldap_users.command(name="import")
+@metrics_options
 @with_appcontext
-def import_users():
+def import_users(quiet, metrics_report, prometheus_textfile):
     """Load users from ldap and import them in db."""
-    import time
-    start_time = time.time()
+    with measured('import', quiet, metrics_report, prometheus_textfile), \
+            locked():
+        ldap_url = current_app.config["CDS_BOOKS_LDAP_URL"]
+        ldap_client = LdapClient(ldap_url)
+        ldap_users = fetch_ldap_users(ldap_client)
 
-    ldap_url = current_app.config["CDS_BOOKS_LDAP_URL"]
-    ldap_client = LdapClient(ldap_url)
-    ldap_users = ldap_client.get_primary_accounts()
+        imported = import_ldap_users(ldap_users)
 
-    click.secho("Users found {}".format(len(ldap_users)))
+        echo_user("Users imported {}".format(len(imported)))
 
-    import_ldap_users(ldap_users)
 
-    click.secho(
-        "--- Finished in %s seconds ---" % (time.time() - start_time),
-        fg="green"
-    )
+@ldap_users.command(name="index")
+@with_appcontext
+def index_users():
+    """Reindex the patrons of all the users with bulk requests.
+
+    Use it instead of ``ils patrons index``, which loads and indexes the
+    patrons one by one.
+    """
+    indexed = bulk_index_all_patrons()
+    click.secho("Patrons indexed {}".format(indexed), fg="green")
 
 
 @ldap_users.command(name="sync")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only fetch the ldap accounts modified since the last sync. A full "
+         "sync still runs when the last one is older than "
+         "CDS_BOOKS_LDAP_FULL_SYNC_INTERVAL.",
+    default=False)
+@metrics_options
 @with_appcontext
-def sync_users():
+def sync_users(incremental, quiet, metrics_report, prometheus_textfile):
     """Sync ldap with system users command."""
-    import time
-    start_time = time.time()
+    with measured('sync', quiet, metrics_report, prometheus_textfile), \
+            locked():
+        state = LdapSyncState.load()
+        started = datetime.utcnow()
+        full = not incremental or state.needs_full_sync(
+            started, current_app.config["CDS_BOOKS_LDAP_FULL_SYNC_INTERVAL"])
+        modified_since = None
+        if not full:
+            modified_since = state.modified_since(
+                current_app.config["CDS_BOOKS_LDAP_SYNC_OVERLAP"])
+            echo_user("Fetching users modified since {}".format(
+                modified_since))
 
-    ldap_url = current_app.config["CDS_BOOKS_LDAP_URL"]
-    ldap_client = LdapClient(ldap_url)
-    system_users = RemoteAccount.query.join(User).all()
-    ldap_users = ldap_client.get_primary_accounts()
+        snapshot = LdapSnapshot.load()
+        if not len(snapshot):
+            echo_user("Building the ldap snapshot from the database")
+            with metrics.timer('db'):
+                snapshot = LdapSnapshot.from_db()
 
-    click.echo("Users fetched")
+        ldap_url = current_app.config["CDS_BOOKS_LDAP_URL"]
+        ldap_client = LdapClient(ldap_url)
+        ldap_users = fetch_ldap_users(
+            ldap_client, modified_since=modified_since)
 
-    ldap_users_map = {}
+        # The accounts are streamed page by page from ldap and compared to
+        # the snapshot on the fly, only the changed ones are kept
+        diff = diff_ldap_users(snapshot, ldap_users, full=full)
+        check_deactivation_ratio(diff.removed, len(snapshot))
+        if diff.added:
+            match_existing_users(snapshot, diff)
+        echo_user("Users fetched: {} added, {} updated, {} removed".format(
+            len(diff.added), len(diff.updated), len(diff.removed)))
 
-    for ldap_user in ldap_users:
-        ldap_person_id = ldap_user["employeeID"][0].decode("utf8")
-        ldap_users_map.update({ldap_person_id: ldap_user})
-
-    for system_user in system_users:
-        system_user_person_id = system_user.extra_data["person_id"]
-        ldap_user = ldap_users_map.get(system_user_person_id)
-        if ldap_user:
-            check_user_for_update(system_user, ldap_user)
-        else:
-            click.secho("Deleting user {} with ccid {}".format(
-                system_user.user, system_user_person_id), fg="red")
-            delete_user(system_user)
+        if diff.updated:
+            update_ldap_users(diff.updated)
+            for user_id, ldap_user, _ in diff.updated:
+                snapshot.add(user_id, ldap_user)
+        echo_user("Users updated {}".format(len(diff.updated)), fg="green")
 
-    # Check if any ldap user is not in our system
+        if diff.removed:
+            deactivate_ldap_users(diff.removed)
+            for _, person_id in diff.removed:
+                snapshot.remove(person_id)
 
-    for ldap_user in ldap_users:
-        ldap_mail = ldap_user["mail"][0].decode("utf8")
-        try:
-            User.query.filter(User.email == ldap_mail).one()
-        except NoResultFound:
-            click.secho("Adding new user {}".format(ldap_mail), fg="green")
-            import_ldap_users([ldap_user])
-
-    click.secho(
-        "--- Finished in %s seconds ---" % (time.time() - start_time),
-        fg="green"
-    )
+        if diff.added:
+            user_ids = import_ldap_users(diff.added)
+            for ldap_user, user_id in zip(diff.added, user_ids):
+                snapshot.add(user_id, ldap_user)
+
+        snapshot.save()
+        state.mark_synced(started, full)
+        state.save()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-migrator-kit is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books ldap users run metrics."""
+
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+TIMERS = ('ldap_fetch', 'db', 'indexing')
+"""Timed phases of an ldap users command."""
+
+COUNTERS = ('ldap_pages', 'ldap_entries', 'skipped', 'added', 'updated',
+            'removed', 'reactivated')
+"""Counted items of an ldap users command."""
+
+PROMETHEUS_PREFIX = 'cds_books_ldap_users'
+
+
+class LdapRunMetrics(object):
+    """Collect the timings and counts of an ldap users command."""
+
+    def __init__(self):
+        """Constructor."""
+        self.quiet = False
+        self.reset()
+
+    def reset(self, command=None):
+        """Forget all the collected metrics."""
+        self.command = command
+        self.timings = OrderedDict((name, 0.0) for name in TIMERS)
+        self.counts = OrderedDict((name, 0) for name in COUNTERS)
+        self.success = False
+        self._phases = []
+        self._since = None
+        self.started = time.time()
+        self._start = time.perf_counter()
+
+    def _switch(self):
+        """Charge the time since the last switch to the current phase."""
+        now = time.perf_counter()
+        if self._phases:
+            self.timings[self._phases[-1]] += now - self._since
+        self._since = now
+
+    @contextmanager
+    def timer(self, name):
+        """Add the time spent in the wrapped block to the given phase.
+
+        Timers can be nested, the time of an inner phase is not charged to
+        the outer one.
+        """
+        self._switch()
+        self._phases.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._phases.pop()
+
+    def timed_iter(self, name, iterable, counter=None):
+        """Yield from iterable, timing each step and counting the items.
+
+        Used to measure lazily fetched results apart from their consumer.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timer(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if counter:
+                self.counts[counter] += 1
+            yield item
+
+    def count(self, name, value=1):
+        """Increment a counter."""
+        self.counts[name] += value
+
+    def report(self):
+        """Return the metrics as a JSON serializable dictionary."""
+        return OrderedDict([
+            ('command', self.command),
+            ('success', self.success),
+            ('started', self.started),
+            ('total_seconds', time.perf_counter() - self._start),
+            ('seconds', dict(self.timings)),
+            ('counts', dict(self.counts)),
+        ])
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        labels = 'command="{}"'.format(self.command)
+        lines = [
+            '# TYPE {}_success gauge'.format(PROMETHEUS_PREFIX),
+            '{}_success{{{}}} {}'.format(
+                PROMETHEUS_PREFIX, labels, int(self.success)),
+            '# TYPE {}_last_run_timestamp_seconds gauge'.format(
+                PROMETHEUS_PREFIX),
+            '{}_last_run_timestamp_seconds{{{}}} {:.0f}'.format(
+                PROMETHEUS_PREFIX, labels, self.started),
+            '# TYPE {}_duration_seconds gauge'.format(PROMETHEUS_PREFIX),
+            '{}_duration_seconds{{{},phase="total"}} {:.3f}'.format(
+                PROMETHEUS_PREFIX, labels, report['total_seconds']),
+        ]
+        lines.extend(
+            '{}_duration_seconds{{{},phase="{}"}} {:.3f}'.format(
+                PROMETHEUS_PREFIX, labels, name, seconds)
+            for name, seconds in self.timings.items()
+        )
+        lines.append('# TYPE {}_items gauge'.format(PROMETHEUS_PREFIX))
+        lines.extend(
+            '{}_items{{{},kind="{}"}} {}'.format(
+                PROMETHEUS_PREFIX, labels, name, value)
+            for name, value in self.counts.items()
+        )
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write the metrics for the node exporter textfile."""
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as fp:
+            fp.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = LdapRunMetrics()
+"""Process-wide metrics of the running ldap users command."""
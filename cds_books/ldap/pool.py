@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-migrator-kit is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books ldap connection pool."""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import ldap
+from flask import current_app
+from ldap.ldapobject import ReconnectLDAPObject
+from werkzeug.utils import import_string
+
+
+class LdapPoolTimeout(Exception):
+    """Raised when no pooled ldap connection is available in time."""
+
+
+def reconnect_ldap_object(ldap_url, retry_max, retry_delay):
+    """Return a python-ldap connection reconnecting automatically."""
+    return ReconnectLDAPObject(
+        ldap_url, retry_max=retry_max, retry_delay=retry_delay)
+
+
+class LdapConnectionPool(object):
+    """Pool of reusable ldap connections.
+
+    Connections are created lazily, up to ``size``, with network and
+    operation timeouts. They reconnect automatically on synchronous
+    operations, and connections failing with ``SERVER_DOWN`` are discarded.
+
+    :param connection_factory: callable returning a new connection from the
+        URL, ``retry_max`` and ``retry_delay``, e.g. to target a fake server.
+    """
+
+    def __init__(self, ldap_url, size=4, network_timeout=10, timeout=60,
+                 retry_max=3, retry_delay=1.0, connection_factory=None):
+        """Constructor."""
+        self.ldap_url = ldap_url
+        self.connection_factory = connection_factory or reconnect_ldap_object
+        self.size = size
+        self.network_timeout = network_timeout
+        self.timeout = timeout
+        self.retry_max = retry_max
+        self.retry_delay = retry_delay
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new connection."""
+        connection = self.connection_factory(
+            self.ldap_url,
+            retry_max=self.retry_max,
+            retry_delay=self.retry_delay
+        )
+        connection.set_option(ldap.OPT_NETWORK_TIMEOUT, self.network_timeout)
+        connection.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        return connection
+
+    def acquire(self):
+        """Return an idle connection, opening one if the pool is not full."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise LdapPoolTimeout(
+                'No ldap connection available after {} seconds'.format(
+                    self.timeout))
+
+    def release(self, connection):
+        """Give a connection back to the pool."""
+        self._idle.put(connection)
+
+    def discard(self, connection):
+        """Close a broken connection and free its slot."""
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the block."""
+        connection = self.acquire()
+        try:
+            yield connection
+        except ldap.SERVER_DOWN:
+            self.discard(connection)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def run(self, operation):
+        """Run ``operation(connection)``, retrying on server disconnects."""
+        attempt = 0
+        while True:
+            try:
+                with self.connection() as connection:
+                    return operation(connection)
+            except ldap.SERVER_DOWN:
+                attempt += 1
+                if attempt > self.retry_max:
+                    raise
+                time.sleep(self.retry_delay)
+
+    def close(self):
+        """Close all the idle connections."""
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(ldap_url):
+    """Return the process-wide connection pool of an ldap URL."""
+    with _pools_lock:
+        pool = _pools.get(ldap_url)
+        if pool is None:
+            config = current_app.config
+            connection_factory = config.get(
+                "CDS_BOOKS_LDAP_CONNECTION_FACTORY")
+            if isinstance(connection_factory, str):
+                connection_factory = import_string(connection_factory)
+            pool = _pools[ldap_url] = LdapConnectionPool(
+                ldap_url,
+                size=config.get("CDS_BOOKS_LDAP_POOL_SIZE", 4),
+                network_timeout=config.get(
+                    "CDS_BOOKS_LDAP_NETWORK_TIMEOUT", 10),
+                timeout=config.get("CDS_BOOKS_LDAP_TIMEOUT", 60),
+                retry_max=config.get("CDS_BOOKS_LDAP_RETRY_MAX", 3),
+                retry_delay=config.get("CDS_BOOKS_LDAP_RETRY_DELAY", 1.0),
+                connection_factory=connection_factory,
+            )
+        return pool
+
+
+def close_pools():
+    """Close and forget all the connection pools of the process."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
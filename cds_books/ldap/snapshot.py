@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-migrator-kit is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books ldap snapshot and diff engine.
+
+The snapshot keeps, for each ldap person id already synchronized, the id of
+its system user and a short hash of each synchronized field. A new ldap
+export is streamed against it and only the accounts that were added, changed
+or removed since the snapshot reach the database.
+"""
+
+import gzip
+import hashlib
+import json
+
+from invenio_accounts.models import User
+from invenio_cache import current_cache
+from invenio_db import db
+from invenio_oauthclient.models import RemoteAccount, UserIdentity
+from invenio_userprofiles.models import UserProfile
+
+from ..patrons.api import get_client_id
+
+SNAPSHOT_FIELDS = ('department', 'display_name', 'mail', 'uid_number')
+"""Fields of `LdapUser` compared between two synchronizations."""
+
+HASH_SIZE = 8
+"""Number of hexadecimal characters of each field hash."""
+
+UNLINKED_HASH = '-' * HASH_SIZE
+"""Field hash never matching a value, e.g. when a remote account is missing."""
+
+SNAPSHOT_KEY = 'cds_books:ldap:snapshot'
+"""Cache key of the compressed ldap snapshot."""
+
+
+def field_hash(value):
+    """Return the short hash of a field value."""
+    data = (value or '').encode('utf8')
+    return hashlib.blake2b(data, digest_size=HASH_SIZE // 2).hexdigest()
+
+
+def fields_hash(values):
+    """Return the concatenated hashes of the `SNAPSHOT_FIELDS` values."""
+    return ''.join(field_hash(value) for value in values)
+
+
+def user_hash(ldap_user):
+    """Return the concatenated field hashes of an `LdapUser`."""
+    return fields_hash(
+        getattr(ldap_user, field) for field in SNAPSHOT_FIELDS)
+
+
+def changed_fields(old_hash, new_hash):
+    """Return the names of the fields whose hash differs."""
+    return tuple(
+        field for index, field in enumerate(SNAPSHOT_FIELDS)
+        if old_hash[index * HASH_SIZE:(index + 1) * HASH_SIZE] !=
+        new_hash[index * HASH_SIZE:(index + 1) * HASH_SIZE]
+    )
+
+
+class LdapSnapshot(object):
+    """Last synchronized state of the ldap accounts.
+
+    Entries map a person id to a ``(user_id, hash)`` pair.
+    """
+
+    def __init__(self, entries=None):
+        """Constructor."""
+        self.entries = entries or {}
+
+    def __len__(self):
+        """Number of synchronized accounts."""
+        return len(self.entries)
+
+    def __contains__(self, person_id):
+        """Whether an account is part of the snapshot."""
+        return person_id in self.entries
+
+    def user_id(self, person_id):
+        """Return the system user id of an account."""
+        return self.entries[person_id][0]
+
+    def add(self, user_id, ldap_user):
+        """Add or refresh the entry of a synchronized account."""
+        self.entries[ldap_user.person_id] = (user_id, user_hash(ldap_user))
+
+    def remove(self, person_id):
+        """Forget an account."""
+        self.entries.pop(person_id, None)
+
+    @classmethod
+    def load(cls, key=SNAPSHOT_KEY):
+        """Load the snapshot, empty if none was saved yet."""
+        data = current_cache.get(key)
+        if not data:
+            return cls()
+        data = json.loads(gzip.decompress(data).decode('utf8'))
+        if tuple(data['fields']) != SNAPSHOT_FIELDS:
+            # The synchronized fields changed, rebuild the snapshot
+            return cls()
+        return cls({
+            person_id: tuple(entry)
+            for person_id, entry in data['entries'].items()
+        })
+
+    def save(self, key=SNAPSHOT_KEY):
+        """Store the compressed snapshot, without expiration."""
+        data = json.dumps(dict(fields=SNAPSHOT_FIELDS, entries=self.entries))
+        current_cache.set(key, gzip.compress(data.encode('utf8')), timeout=0)
+
+    @classmethod
+    def from_db(cls):
+        """Build the snapshot of the accounts currently in the database.
+
+        Only the needed columns are fetched, in a single query.
+        """
+        rows = db.session.query(
+            RemoteAccount.user_id,
+            RemoteAccount.extra_data,
+            User.email,
+            UserProfile.full_name,
+            UserIdentity.id,
+        ).join(
+            User, User.id == RemoteAccount.user_id
+        ).outerjoin(
+            UserProfile, UserProfile.user_id == RemoteAccount.user_id
+        ).outerjoin(
+            UserIdentity, db.and_(
+                UserIdentity.id_user == RemoteAccount.user_id,
+                UserIdentity.method == 'cern')
+        ).filter(RemoteAccount.client_id == get_client_id())
+        snapshot = cls()
+        for user_id, extra_data, email, full_name, uid_number in rows:
+            extra_data = extra_data or {}
+            person_id = extra_data.get("person_id")
+            if not person_id or extra_data.get("deactivated_at"):
+                continue
+            snapshot.entries[person_id] = (
+                user_id,
+                fields_hash((extra_data.get("department"), full_name,
+                             email, uid_number))
+            )
+        return snapshot
+
+
+class LdapDiff(object):
+    """Changes between a snapshot and a new ldap export.
+
+    :attr added: new `LdapUser` accounts.
+    :attr updated: ``(user_id, LdapUser, fields)`` of the changed accounts,
+        with the names of the changed fields.
+    :attr removed: ``(user_id, person_id)`` of the accounts gone from ldap.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.added = []
+        self.updated = []
+        self.removed = []
+
+    def __len__(self):
+        """Total number of changes."""
+        return len(self.added) + len(self.updated) + len(self.removed)
+
+
+def existing_users_hashes(existing, chunk_size=1000):
+    """Return the field hashes of matched system users, from the database.
+
+    :param existing: dictionary of person id to user id, as returned by
+        `LdapUserImporter.find_existing`.
+    :return: dictionary of person id to the hash of its user. The department
+        of a user without a remote account linked to the person never
+        matches, so that the account gets linked.
+    """
+    person_ids = {
+        user_id: person_id for person_id, user_id in existing.items()
+    }
+    user_ids = list(person_ids)
+    department = SNAPSHOT_FIELDS.index('department')
+    hashes = {}
+    for start in range(0, len(user_ids), chunk_size):
+        rows = db.session.query(
+            User.id,
+            RemoteAccount.extra_data,
+            User.email,
+            UserProfile.full_name,
+            UserIdentity.id,
+        ).outerjoin(
+            RemoteAccount, db.and_(
+                RemoteAccount.user_id == User.id,
+                RemoteAccount.client_id == get_client_id())
+        ).outerjoin(
+            UserProfile, UserProfile.user_id == User.id
+        ).outerjoin(
+            UserIdentity, db.and_(
+                UserIdentity.id_user == User.id,
+                UserIdentity.method == 'cern')
+        ).filter(User.id.in_(user_ids[start:start + chunk_size]))
+        for user_id, extra_data, email, full_name, uid_number in rows:
+            person_id = person_ids[user_id]
+            extra_data = extra_data or {}
+            field_hashes = [
+                field_hash(value) for value in (
+                    extra_data.get("department"), full_name, email,
+                    uid_number)
+            ]
+            if extra_data.get("person_id") != person_id:
+                field_hashes[department] = UNLINKED_HASH
+            hashes[person_id] = ''.join(field_hashes)
+    return hashes
+
+
+def adopt_existing_users(snapshot, diff, existing):
+    """Diff the added accounts which already have a system user.
+
+    The matched accounts are added to the snapshot with the state of their
+    user in the database, and moved from ``diff.added`` to ``diff.updated``
+    when a field differs.
+
+    :param existing: dictionary of person id to user id of the matched
+        accounts, as returned by `LdapUserImporter.find_existing`.
+    """
+    hashes = existing_users_hashes(existing)
+    added = []
+    for ldap_user in diff.added:
+        person_id = ldap_user.person_id
+        old_hash = hashes.get(person_id)
+        if old_hash is None:
+            added.append(ldap_user)
+            continue
+        user_id = existing[person_id]
+        snapshot.entries[person_id] = (user_id, old_hash)
+        new_hash = user_hash(ldap_user)
+        if new_hash != old_hash:
+            diff.updated.append(
+                (user_id, ldap_user, changed_fields(old_hash, new_hash)))
+    diff.added = added
+
+
+def diff_ldap_users(snapshot, ldap_users, full=True):
+    """Stream ldap accounts against a snapshot and return their `LdapDiff`.
+
+    :param snapshot: `LdapSnapshot` of the last synchronization.
+    :param ldap_users: iterable of `LdapUser`, consumed once.
+    :param full: whether ``ldap_users`` is the complete export. Removed
+        accounts can only be detected from a complete export.
+    """
+    diff = LdapDiff()
+    seen = set()
+    for ldap_user in ldap_users:
+        person_id = ldap_user.person_id
+        seen.add(person_id)
+        entry = snapshot.entries.get(person_id)
+        if entry is None:
+            diff.added.append(ldap_user)
+            continue
+        user_id, old_hash = entry
+        new_hash = user_hash(ldap_user)
+        if new_hash != old_hash:
+            diff.updated.append(
+                (user_id, ldap_user, changed_fields(old_hash, new_hash)))
+    if full:
+        diff.removed = [
+            (entry[0], person_id)
+            for person_id, entry in snapshot.entries.items()
+            if person_id not in seen
+        ]
+    return diff
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-migrator-kit is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books ldap synchronization state and lock.
+
+Both are kept in the shared cache, as the synchronization steps can run on
+different hosts, e.g. the chunks of the asynchronous sync.
+"""
+
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from invenio_cache import current_cache
+
+LDAP_TIMESTAMP_FORMAT = '%Y%m%d%H%M%SZ'
+"""Generalized time format of the ldap ``modifyTimestamp`` attribute."""
+
+STATE_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SYNC_STATE_KEY = 'cds_books:ldap:sync_state'
+"""Cache key of the synchronization state."""
+
+SYNC_LOCK_KEY = 'cds_books:ldap:sync_lock'
+"""Cache key of the lock held during a synchronization."""
+
+
+def ldap_timestamp(dt):
+    """Format a UTC datetime as an ldap generalized time."""
+    return dt.strftime(LDAP_TIMESTAMP_FORMAT)
+
+
+class LdapSyncLocked(Exception):
+    """Raised when another ldap synchronization is running."""
+
+
+def acquire_sync_lock():
+    """Take the lock of the ldap synchronizations, on all the hosts.
+
+    The lock expires after ``CDS_BOOKS_LDAP_SYNC_LOCK_TIMEOUT``, in case its
+    holder dies without releasing it.
+
+    :return: the token releasing the lock.
+    """
+    token = uuid.uuid4().hex
+    timeout = current_app.config["CDS_BOOKS_LDAP_SYNC_LOCK_TIMEOUT"]
+    if not current_cache.add(
+            SYNC_LOCK_KEY, token, timeout=int(timeout.total_seconds())):
+        raise LdapSyncLocked("Another ldap synchronization is running.")
+    return token
+
+
+def release_sync_lock(token):
+    """Release the lock, unless it expired and was taken again."""
+    if current_cache.get(SYNC_LOCK_KEY) == token:
+        current_cache.delete(SYNC_LOCK_KEY)
+
+
+@contextmanager
+def sync_lock():
+    """Hold the lock of the ldap synchronizations in the wrapped block."""
+    token = acquire_sync_lock()
+    try:
+        yield token
+    finally:
+        release_sync_lock(token)
+
+
+class LdapSyncState(object):
+    """High-water marks of the last successful ldap synchronizations."""
+
+    def __init__(self, last_sync=None, last_full_sync=None):
+        """Constructor."""
+        self.last_sync = last_sync
+        self.last_full_sync = last_full_sync
+
+    @classmethod
+    def load(cls, key=SYNC_STATE_KEY):
+        """Load the state, empty if no synchronization happened yet."""
+        data = current_cache.get(key)
+        if not data:
+            return cls()
+        return cls(**{
+            key: datetime.strptime(data[key], STATE_TIMESTAMP_FORMAT)
+            for key in ('last_sync', 'last_full_sync') if data.get(key)
+        })
+
+    def save(self, key=SYNC_STATE_KEY):
+        """Store the state, without expiration."""
+        data = {
+            key: value.strftime(STATE_TIMESTAMP_FORMAT)
+            for key, value in (('last_sync', self.last_sync),
+                               ('last_full_sync', self.last_full_sync))
+            if value
+        }
+        current_cache.set(key, data, timeout=0)
+
+    def needs_full_sync(self, now, interval):
+        """Whether a full sweep is due to detect the removed accounts."""
+        return not self.last_sync or not self.last_full_sync or \
+            now - self.last_full_sync >= interval
+
+    def modified_since(self, overlap):
+        """Return the lower bound of the next incremental synchronization.
+
+        The overlap compensates for clock skew between ldap and this host
+        and for entries modified while the previous run was fetching.
+        """
+        return self.last_sync - overlap
+
+    def mark_synced(self, started, full):
+        """Record a successful synchronization started at the given time."""
+        self.last_sync = started
+        if full:
+            self.last_full_sync = started
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-migrator-kit is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books ldap users Celery tasks.
+
+`sync_users` is the asynchronous variant of the ``ldap-users sync`` command:
+it streams the ldap export against the snapshot and applies the diff in
+chunks, each chunk in its own task, in parallel on the Celery workers. A
+final task records the applied chunks in the snapshot. The synchronizations
+lock is held from the start of `sync_users` to the end of this final task.
+"""
+
+from datetime import datetime
+
+from celery import chord, shared_task
+from flask import current_app
+from invenio_db import db
+
+from ..patrons.indexer import bulk_delete_patrons, bulk_index_patrons
+from .api import LdapClient, LdapUser, LdapUserDeactivator, \
+    LdapUserImporter, LdapUserReactivator, LdapUserUpdater
+from .snapshot import LdapSnapshot, adopt_existing_users, diff_ldap_users, \
+    user_hash
+from .sync import LdapSyncState, acquire_sync_lock, release_sync_lock
+
+PROGRESS_INTERVAL = 10000
+"""Number of fetched ldap entries between two progress updates."""
+
+
+def chunked(items, size):
+    """Split a list in lists of at most size items."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+@shared_task(ignore_result=False)
+def import_users_chunk(ldap_users):
+    """Import a chunk of new ldap users.
+
+    :param ldap_users: `LdapUser` fields dictionaries.
+    :return: the snapshot entries of the imported users.
+    """
+    ldap_users = LdapUserImporter.exclude_existing(
+        [LdapUser(**ldap_user) for ldap_user in ldap_users])
+    importer = LdapUserImporter(ldap_users, verbose=False)
+    importer.import_users()
+    bulk_index_patrons(importer.user_ids)
+    return dict(added=[
+        (ldap_user.person_id, user_id, user_hash(ldap_user))
+        for ldap_user, user_id in zip(ldap_users, importer.user_ids)
+    ])
+
+
+@shared_task(ignore_result=False)
+def update_users_chunk(updates):
+    """Apply a chunk of ldap account changes.
+
+    :param updates: ``(user_id, LdapUser fields, changed fields)``.
+    :return: the snapshot entries of the updated users.
+    """
+    updates = [
+        (user_id, LdapUser(**ldap_user), fields)
+        for user_id, ldap_user, fields in updates
+    ]
+    user_ids = LdapUserUpdater(updates).update_users()
+    bulk_index_patrons(user_ids)
+    return dict(updated=[
+        (ldap_user.person_id, user_id, user_hash(ldap_user))
+        for user_id, ldap_user, _ in updates
+    ])
+
+
+@shared_task(ignore_result=False)
+def deactivate_users_chunk(removed):
+    """Deactivate a chunk of users removed from ldap.
+
+    :param removed: ``(user_id, person_id)`` of the removed accounts.
+    :return: the person ids of the deactivated users.
+    """
+    user_ids = LdapUserDeactivator(
+        user_id for user_id, _ in removed).deactivate()
+    person_ids = [person_id for _, person_id in removed]
+    bulk_delete_patrons(user_ids, person_ids=person_ids)
+    return dict(removed=person_ids)
+
+
+@shared_task(ignore_result=True)
+def unlock_sync(lock_token):
+    """Release the synchronizations lock when the sync failed."""
+    release_sync_lock(lock_token)
+
+
+@shared_task(ignore_result=False)
+def finish_sync(results, started, full, lock_token):
+    """Record the applied chunks in the snapshot and the sync state.
+
+    :param results: results of the chunk tasks.
+    :param started: ISO start time of the sync.
+    :param full: whether the sync was a full one.
+    :param lock_token: token releasing the synchronizations lock.
+    """
+    try:
+        return record_sync(results, started, full)
+    finally:
+        release_sync_lock(lock_token)
+
+
+def record_sync(results, started, full):
+    """Record the applied chunks, return the number of changes per type."""
+    snapshot = LdapSnapshot.load()
+    counts = dict(added=0, updated=0, removed=0)
+    for result in results:
+        for person_id, user_id, hash_ in result.get('added', []) + \
+                result.get('updated', []):
+            snapshot.entries[person_id] = (user_id, hash_)
+        for person_id in result.get('removed', []):
+            snapshot.remove(person_id)
+        for key in counts:
+            counts[key] += len(result.get(key, []))
+    snapshot.save()
+
+    state = LdapSyncState.load()
+    state.mark_synced(
+        datetime.strptime(started, '%Y-%m-%dT%H:%M:%S.%f'), full)
+    state.save()
+    return counts
+
+
+@shared_task(bind=True, ignore_result=False)
+def sync_users(self, incremental=True):
+    """Synchronize the system users with ldap, in parallel chunks.
+
+    The progress is reported with the ``PROGRESS`` state, the chunks results
+    are stored by the ``finish_sync`` task. Fails with `LdapSyncLocked` when
+    another synchronization is running.
+    """
+    lock_token = acquire_sync_lock()
+    try:
+        return start_sync(self, incremental, lock_token)
+    except BaseException:
+        release_sync_lock(lock_token)
+        raise
+
+
+def start_sync(task, incremental, lock_token):
+    """Diff ldap with the snapshot and dispatch the chunk tasks."""
+    config = current_app.config
+    state = LdapSyncState.load()
+    started = datetime.utcnow()
+    full = not incremental or state.needs_full_sync(
+        started, config["CDS_BOOKS_LDAP_FULL_SYNC_INTERVAL"])
+    modified_since = None
+    if not full:
+        modified_since = state.modified_since(
+            config["CDS_BOOKS_LDAP_SYNC_OVERLAP"])
+
+    snapshot = LdapSnapshot.load()
+    if not len(snapshot):
+        snapshot = LdapSnapshot.from_db()
+        snapshot.save()
+    # Chunks run in their own sessions, release the connection meanwhile
+    db.session.remove()
+
+    ldap_client = LdapClient(config["CDS_BOOKS_LDAP_URL"])
+
+    def fetch():
+        for fetched, ldap_user in enumerate(
+                ldap_client.get_primary_accounts(
+                    modified_since=modified_since), 1):
+            if fetched % PROGRESS_INTERVAL == 0:
+                task.update_state(state='PROGRESS', meta=dict(
+                    stage='fetch', fetched=fetched))
+            yield ldap_user
+
+    diff = diff_ldap_users(snapshot, fetch(), full=full)
+    LdapUserDeactivator.check_ratio(diff.removed, len(snapshot))
+    if diff.added:
+        # The accounts matched to existing users are recorded right away
+        existing = LdapUserImporter.find_existing(diff.added)
+        reactivated = LdapUserReactivator(existing.values()).reactivate()
+        adopt_existing_users(snapshot, diff, existing)
+        snapshot.save()
+        updated = set(user_id for user_id, _, _ in diff.updated)
+        bulk_index_patrons([
+            user_id for user_id in reactivated if user_id not in updated])
+        db.session.remove()
+
+    size = config["CDS_BOOKS_LDAP_TASK_CHUNK_SIZE"]
+    chunks = [
+        import_users_chunk.s([ldap_user.to_dict() for ldap_user in chunk])
+        for chunk in chunked(diff.added, size)
+    ] + [
+        update_users_chunk.s([
+            (user_id, ldap_user.to_dict(), fields)
+            for user_id, ldap_user, fields in chunk
+        ])
+        for chunk in chunked(diff.updated, size)
+    ] + [
+        deactivate_users_chunk.s(chunk)
+        for chunk in chunked(diff.removed, size)
+    ]
+    meta = dict(
+        stage='apply',
+        full=full,
+        added=len(diff.added),
+        updated=len(diff.updated),
+        removed=len(diff.removed),
+        chunks=len(chunks),
+    )
+    task.update_state(state='PROGRESS', meta=meta)
+    callback = finish_sync.s(
+        started.isoformat(timespec='microseconds'), full, lock_token
+    ).on_error(unlock_sync.si(lock_token))
+    if chunks:
+        meta['finish_task_id'] = chord(chunks)(callback).id
+    else:
+        meta['finish_task_id'] = callback.apply_async(([],)).id
+    return meta
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-books is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""In-process ldap stand-in used to test and benchmark the ldap users CLI.
+
+A `FakeLdapDirectory` holds synthetic CERN accounts and is used as the
+``CDS_BOOKS_LDAP_CONNECTION_FACTORY``, e.g.::
+
+    directory = FakeLdapDirectory(users=10000, latency=0.005)
+    app.config['CDS_BOOKS_LDAP_CONNECTION_FACTORY'] = directory
+
+Its connections implement the subset of ``ldap.ldapobject.LDAPObject`` used
+by `LdapClient`: asynchronous searches with the RFC 2696 simple paged results
+control and the filters built by the client. As on a real server, the paged
+search cookies are only valid on the connection which returned them. Server
+disconnects can be simulated with `FakeLdapDirectory.disconnect`.
+"""
+
+import itertools
+import re
+import threading
+import time
+from datetime import datetime
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from .sync import ldap_timestamp
+
+DEPARTMENTS = ('IT/CDA', 'IT/DB', 'EP/SFT', 'TH', 'BE/ABP', 'HR/TA')
+
+_ESCAPED = re.compile(r'\\([0-9a-fA-F]{2})')
+
+
+def _unescape(value):
+    """Revert ``ldap.filter.escape_filter_chars``."""
+    return _ESCAPED.sub(lambda match: chr(int(match.group(1), 16)), value)
+
+
+def _parse(text, pos):
+    """Parse the filter starting at pos, return the node and the end."""
+    assert text[pos] == '(', 'Invalid ldap filter {}'.format(text)
+    pos += 1
+    if text[pos] in '&|':
+        operator = text[pos]
+        pos += 1
+        children = []
+        while text[pos] == '(':
+            child, pos = _parse(text, pos)
+            children.append(child)
+        return (operator, children), pos + 1
+    if text[pos] == '!':
+        child, pos = _parse(text, pos + 1)
+        return ('!', child), pos + 1
+    end = text.index(')', pos)
+    item = text[pos:end]
+    for operator in ('>=', '<=', '='):
+        if operator in item:
+            attribute, value = item.split(operator, 1)
+            break
+    parts = [_unescape(part).lower() for part in value.split('*')]
+    if len(parts) == 1:
+        return (operator, attribute, parts[0]), end + 1
+    pattern = re.compile(
+        '^{}$'.format('.*'.join(re.escape(part) for part in parts)),
+        re.DOTALL)
+    return ('~', attribute, pattern), end + 1
+
+
+def parse_filter(text):
+    """Parse an ldap filter string into nested tuples."""
+    node, end = _parse(text, 0)
+    assert end == len(text), 'Invalid ldap filter {}'.format(text)
+    return node
+
+
+def match_filter(node, entry):
+    """Whether an ldap entry matches a parsed filter."""
+    operator = node[0]
+    if operator == '&':
+        return all(match_filter(child, entry) for child in node[1])
+    if operator == '|':
+        return any(match_filter(child, entry) for child in node[1])
+    if operator == '!':
+        return not match_filter(node[1], entry)
+    _, attribute, expected = node
+    values = [value.decode('utf8').lower()
+              for value in entry.get(attribute, [])]
+    if operator == '=':
+        return expected in values
+    if operator == '>=':
+        return any(value >= expected for value in values)
+    if operator == '<=':
+        return any(value <= expected for value in values)
+    return any(expected.match(value) for value in values)
+
+
+class FakeLdapConnection(object):
+    """Connection to a `FakeLdapDirectory`."""
+
+    def __init__(self, directory):
+        """Constructor."""
+        self.directory = directory
+        self._msgids = itertools.count(1)
+        self._search_ids = itertools.count(1)
+        self._pending = {}
+        self._searches = {}
+
+    def set_option(self, option, value):
+        """Accept the connection options."""
+
+    def unbind_s(self):
+        """Close the connection."""
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)',
+                   attrlist=None, attrsonly=0, serverctrls=None, **kwargs):
+        """Start a search and return its message id."""
+        page_control = None
+        for control in serverctrls or []:
+            if control.controlType == SimplePagedResultsControl.controlType:
+                page_control = control
+        msgid = next(self._msgids)
+        self._pending[msgid] = (filterstr, attrlist, page_control)
+        return msgid
+
+    def _page(self, filterstr, page_control):
+        """Return the next page of a search and its cookie."""
+        if page_control.cookie:
+            search_id = int(page_control.cookie)
+            if search_id not in self._searches:
+                raise ldap.UNWILLING_TO_PERFORM(
+                    {'desc': 'paged results cookie is invalid'})
+        else:
+            search_id = next(self._search_ids)
+            self._searches[search_id] = (
+                self.directory.search(filterstr), 0)
+        entries, offset = self._searches.pop(search_id)
+        end = offset + page_control.size
+        if end >= len(entries):
+            return entries[offset:], b''
+        self._searches[search_id] = (entries, end)
+        return entries[offset:end], str(search_id).encode()
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        """Return the results of a search with the response controls."""
+        filterstr, attrlist, page_control = self._pending.pop(msgid)
+        if self.directory.latency:
+            time.sleep(self.directory.latency)
+        if self.directory.disconnected():
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        controls = []
+        if page_control is None:
+            entries = self.directory.search(filterstr)
+        else:
+            entries, cookie = self._page(filterstr, page_control)
+            controls.append(SimplePagedResultsControl(
+                True, size=page_control.size, cookie=cookie))
+        data = [
+            (dn, {name: entry[name] for name in attrlist or entry
+                  if name in entry})
+            for dn, entry in entries
+        ]
+        return ldap.RES_SEARCH_RESULT, data, msgid, controls
+
+    def result(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        """Return the results of a search."""
+        return self.result3(msgid, all=all, timeout=timeout)[:2]
+
+
+class FakeLdapDirectory(object):
+    """Synthetic ldap directory of primary CERN accounts.
+
+    :param users: number of generated accounts.
+    :param latency: seconds spent by the server to answer each search page.
+    :param start_person_id: person id of the first account.
+    """
+
+    def __init__(self, users=1000, latency=0.0, start_person_id=1):
+        """Constructor."""
+        self.latency = latency
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._answers_before_disconnect = 0
+        self._disconnects = 0
+        for person_id in range(start_person_id, start_person_id + users):
+            self.add(**self.user_attributes(person_id))
+
+    @staticmethod
+    def user_attributes(person_id):
+        """Return the attributes of a generated account."""
+        return dict(
+            employeeID=str(person_id),
+            mail='user{}@cern.ch'.format(person_id),
+            displayName='User {}'.format(person_id),
+            department=DEPARTMENTS[person_id % len(DEPARTMENTS)],
+            uidNumber=str(100000 + person_id),
+            cernAccountType='Primary',
+        )
+
+    def add(self, modified=None, **attributes):
+        """Add an account, its ``employeeID`` attribute is required."""
+        modified = modified or datetime(2019, 1, 1)
+        attributes['modifyTimestamp'] = ldap_timestamp(modified)
+        person_id = attributes['employeeID']
+        self.entries[person_id] = (
+            'CN={},OU=Users,OU=Organic Units,DC=cern,DC=ch'.format(person_id),
+            {name: [value.encode('utf8')]
+             for name, value in attributes.items()}
+        )
+
+    def modify(self, person_id, modified=None, **attributes):
+        """Change attributes of an account and its ``modifyTimestamp``."""
+        modified = modified or datetime.utcnow()
+        entry = self.entries[str(person_id)][1]
+        attributes['modifyTimestamp'] = ldap_timestamp(modified)
+        for name, value in attributes.items():
+            entry[name] = [value.encode('utf8')]
+
+    def remove(self, person_id):
+        """Remove an account."""
+        del self.entries[str(person_id)]
+
+    def search(self, filterstr):
+        """Return the ``(dn, entry)`` matching an ldap filter."""
+        node = parse_filter(filterstr)
+        return [
+            (dn, entry) for dn, entry in list(self.entries.values())
+            if match_filter(node, entry)
+        ]
+
+    def disconnect(self, after=0, times=1):
+        """Drop the connections answering the next searches.
+
+        :param after: number of searches answered before the first drop.
+        :param times: number of consecutive searches failing with
+            ``ldap.SERVER_DOWN``.
+        """
+        with self._lock:
+            self._answers_before_disconnect = after
+            self._disconnects = times
+
+    def disconnected(self):
+        """Whether the connection answering a search is dropped."""
+        with self._lock:
+            if not self._disconnects:
+                return False
+            if self._answers_before_disconnect:
+                self._answers_before_disconnect -= 1
+                return False
+            self._disconnects -= 1
+            return True
+
+    def __call__(self, ldap_url, retry_max=None, retry_delay=None):
+        """Open a connection, to be used as connection factory."""
+        return FakeLdapConnection(self)
@@ -31,7 +31,10 @@ from invenio_records.models import RecordMetadata
 
 from cds_books.migrator.errors import DocumentMigrationError, \
     LossyConversion, MultipartMigrationError, SerialMigrationError
+from cds_books.migrator.profiling import profiler
 from cds_books.migrator.records import CDSParentRecordDumpLoader
+from cds_books.migrator.schemas import CachedSchemaValidator, \
+    PrevalidatedValidator, validate_deferred
 
 
 @contextmanager
@@ -39,7 +42,8 @@ def commit():
     """Commit transaction or rollback in case of an exception."""
     try:
         yield
-        db.session.commit()
+        with profiler.stage('db_commit'):
+            db.session.commit()
     except:
         print('Rolling back changes...')
         db.session.rollback()
@@ -51,12 +55,13 @@ def reindex_pidtype(pid_type):
     click.echo('Indexing pid type "{}"...'.format(pid_type))
     cli = create_cli()
     runner = current_app.test_cli_runner()
-    runner.invoke(
-        cli,
-        'index reindex --pid-type {} --yes-i-know'.format(pid_type),
-        catch_exceptions=False
-    )
-    runner.invoke(cli, 'index run', catch_exceptions=False)
+    with profiler.stage('indexing'):
+        runner.invoke(
+            cli,
+            'index reindex --pid-type {} --yes-i-know'.format(pid_type),
+            catch_exceptions=False
+        )
+        runner.invoke(cli, 'index run', catch_exceptions=False)
     click.echo('Indexing completed!')
 
 
@@ -65,8 +70,9 @@ def bulk_index_records(records):
     indexer = RecordIndexer()
 
     click.echo('Bulk indexing {} records...'.format(len(records)))
-    indexer.bulk_index([str(r.id) for r in records])
-    indexer.process_bulk_queue()
+    with profiler.stage('indexing'):
+        indexer.bulk_index([str(r.id) for r in records])
+        indexer.process_bulk_queue()
     click.echo('Indexing completed!')
 
 
@@ -82,33 +88,58 @@ def model_provider_by_rectype(rectype):
         raise ValueError('Unknown rectype: {}'.format(rectype))
 
 
-def import_parents_from_file(dump_file, rectype, include):
+def prevalidate_dumps(records, model, workers=None):
+    """Validate dumps in a pool of workers and return the valid ones."""
+    click.echo('Validating {} records...'.format(len(records)))
+    with profiler.stage('deferred_validation'):
+        errors = validate_deferred(records, model, workers=workers)
+    for index, message in sorted(errors.items()):
+        click.secho('Skipping invalid record {}: {}'.format(
+            records[index].get('legacy_recid', index), message), fg='red')
+    return [
+        dump for index, dump in enumerate(records) if index not in errors]
+
+
+def import_parents_from_file(dump_file, rectype, include,
+                             deferred_validation=False, workers=None):
     """Load parent records from file."""
     model, provider = model_provider_by_rectype(rectype)
     include_keys = None if include is None else include.split(',')
-    with click.progressbar(json.load(dump_file).items()) as bar:
+    parents = []
+    for key, parent in json.load(dump_file).items():
+        if include_keys is None or key in include_keys:
+            has_children = parent.get('_migration', {}).get('children', [])
+            has_volumes = parent.get('_migration', {}).get('volumes', [])
+            if rectype == 'serial' and has_children:
+                parents.append(parent)
+            elif rectype == 'multipart' and has_volumes:
+                parents.append(parent)
+    validator = CachedSchemaValidator
+    if deferred_validation:
+        parents = prevalidate_dumps(parents, model, workers=workers)
+        validator = PrevalidatedValidator
+    with click.progressbar(parents,
+                           item_show_func=profiler.item_show_func) as bar:
         records = []
-        for key, parent in bar:
-            if include_keys is None or key in include_keys:
-                has_children = parent.get('_migration', {}).get('children', [])
-                has_volumes = parent.get('_migration', {}).get('volumes', [])
-                if rectype == 'serial' and has_children:
-                    record = import_record(parent, model, provider)
-                    records.append(record)
-                elif rectype == 'multipart' and has_volumes:
-                    record = import_record(parent, model, provider)
-                    records.append(record)
+        for parent in bar:
+            with profiler.record():
+                record = import_record(parent, model, provider, validator)
+            records.append(record)
     # Index all new parent records
     bulk_index_records(records)
 
 
-def import_record(dump, model, pid_provider):
+def import_record(dump, model, pid_provider,
+                  validator=CachedSchemaValidator):
     """Import record in database."""
-    record = CDSParentRecordDumpLoader.create(dump, model, pid_provider)
+    record = CDSParentRecordDumpLoader.create(
+        dump, model, pid_provider, validator)
     return record
 
 
-def import_documents_from_record_file(sources, include):
+def import_documents_from_record_file(sources, include,
+                                      deferred_validation=False,
+                                      workers=None):
     """Import documents from records file generated by CDS-Migrator-Kit."""
     include = include if include is None else include.split(',')
     records = []
@@ -117,16 +148,26 @@ def import_documents_from_record_file(sources, include):
             idx, len(sources), source.name))
         model, provider = model_provider_by_rectype('document')
         include_keys = None if include is None else include.split(',')
-        with click.progressbar(json.load(source).items()) as bar:
+        documents = [
+            document for key, document in json.load(source).items()
+            if include_keys is None or key in include_keys
+        ]
+        validator = CachedSchemaValidator
+        if deferred_validation:
+            documents = prevalidate_dumps(documents, model, workers=workers)
+            validator = PrevalidatedValidator
+        with click.progressbar(documents,
+                               item_show_func=profiler.item_show_func) as bar:
             records = []
-            for key, parent in bar:
-                if include_keys is None or key in include_keys:
+            for document in bar:
+                with profiler.record():
                     record = import_record(
-                        parent,
+                        document,
                         model,
-                        provider
+                        provider,
+                        validator
                     )
-                    records.append(record)
+                records.append(record)
     # Index all new parent records
     bulk_index_records(records)
 
@@ -138,10 +179,12 @@ def import_documents_from_dump(sources, source_type, eager, include):
         click.echo('({}/{}) Migrating documents in {}...'.format(
             idx, len(sources), source.name))
         data = json.load(source)
-        with click.progressbar(data) as records:
+        with click.progressbar(
+                data, item_show_func=profiler.item_show_func) as records:
             for item in records:
                 if include is None or str(item['recid']) in include:
-                    _loadrecord(item, source_type, eager=eager)
+                    with profiler.record():
+                        _loadrecord(item, source_type, eager=eager)
     # We don't get the record back from _loadrecord so re-index all documents
     reindex_pidtype('docid')
 
@@ -197,7 +240,8 @@ def create_multipart_volumes(pid, multipart_legacy_recid, migration_volumes):
     first['_migration']['multipart_legacy_recid'] = multipart_legacy_recid
     if 'legacy_recid' in first:
         del first['legacy_recid']
-    first.commit()
+    with profiler.stage('record_commit'):
+        first.commit(validator=CachedSchemaValidator)
     yield first
 
     # Create new records for the rest
@@ -206,25 +250,30 @@ def create_multipart_volumes(pid, multipart_legacy_recid, migration_volumes):
         temp['title']['title'] = volumes[number]['title']
         temp['volume'] = number
         record_uuid = uuid.uuid4()
-        provider = DocumentIdProvider.create(
-            object_type='rec',
-            object_uuid=record_uuid,
-        )
+        with profiler.stage('pid_minting'):
+            provider = DocumentIdProvider.create(
+                object_type='rec',
+                object_uuid=record_uuid,
+            )
         temp['pid'] = provider.pid.pid_value
-        record = Document.create(temp, record_uuid)
-        record.commit()
+        with profiler.stage('record_create'):
+            record = Document.create(
+                temp, record_uuid, validator=CachedSchemaValidator)
+        with profiler.stage('record_commit'):
+            record.commit(validator=CachedSchemaValidator)
         yield record
 
 
 def create_parent_child_relation(parent, child, relation_type, volume):
     """Create parent child relations."""
     rr = RecordRelationsParentChild()
-    rr.add(
-        parent=parent,
-        child=child,
-        relation_type=relation_type,
-        volume=str(volume) if volume else None
-    )
+    with profiler.stage('relation'):
+        rr.add(
+            parent=parent,
+            child=child,
+            relation_type=relation_type,
+            volume=str(volume) if volume else None
+        )
 
 
 def link_and_create_multipart_volumes():
@@ -235,20 +284,21 @@ def link_and_create_multipart_volumes():
     for hit in search.scan():
         if 'legacy_recid' not in hit:
             continue
-        multipart = get_multipart_by_legacy_recid(hit.legacy_recid)
-        documents = create_multipart_volumes(
-            hit.pid,
-            hit.legacy_recid,
-            hit._migration.volumes
-        )
-        for document in documents:
-            if document and multipart:
-                create_parent_child_relation(
-                    multipart,
-                    document,
-                    current_app.config['MULTIPART_MONOGRAPH_RELATION'],
-                    document['volume']
-                )
+        with profiler.record():
+            multipart = get_multipart_by_legacy_recid(hit.legacy_recid)
+            documents = create_multipart_volumes(
+                hit.pid,
+                hit.legacy_recid,
+                hit._migration.volumes
+            )
+            for document in documents:
+                if document and multipart:
+                    create_parent_child_relation(
+                        multipart,
+                        document,
+                        current_app.config['MULTIPART_MONOGRAPH_RELATION'],
+                        document['volume']
+                    )
 
 
 def get_serials_by_child_recid(recid):
@@ -285,18 +335,19 @@ def link_documents_and_serials():
             # means it's a volume of a multipart
             if 'legacy_recid' not in hit:
                 continue
-            record = record_cls.get_record_by_pid(hit.pid)
-            for serial in get_serials_by_child_recid(hit.legacy_recid):
-                volume = get_migrated_volume_by_serial_title(
-                    record,
-                    serial['title']['title']
-                )
-                create_parent_child_relation(
-                    serial,
-                    record,
-                    current_app.config['SERIAL_RELATION'],
-                    volume
-                )
+            with profiler.record():
+                record = record_cls.get_record_by_pid(hit.pid)
+                for serial in get_serials_by_child_recid(hit.legacy_recid):
+                    volume = get_migrated_volume_by_serial_title(
+                        record,
+                        serial['title']['title']
+                    )
+                    create_parent_child_relation(
+                        serial,
+                        record,
+                        current_app.config['SERIAL_RELATION'],
+                        volume
+                    )
 
     click.echo('Creating serial relations...')
     link_records_and_serial(
@@ -310,94 +361,3 @@ def link_documents_and_serials():
             Q('term', _migration__has_serial=True),
         ])
     )
-
-
-def validate_serial_records():
-    """Validate that serials were migrated successfully.
-
-    Performs the following checks:
-    * Find duplicate serials
-    * Ensure all children of migrated serials were migrated
-    """
-    def validate_serial_relation(serial, recids):
-        relations = serial.relations.get().get('serial', [])
-        if len(recids) != len(relations):
-            click.echo(
-                '[Serial {}] Incorrect number of children: {} '
-                '(expected {})'.format(
-                    serial['pid'],
-                    len(relations),
-                    len(recids)
-                )
-            )
-        for relation in relations:
-            child = Document.get_record_by_pid(
-                relation['pid'],
-                pid_type=relation['pid_type']
-            )
-            if 'legacy_recid' in child and child['legacy_recid'] not in recids:
-                click.echo(
-                    '[Serial {}] Unexpected child with legacy '
-                    'recid: {}'.format(serial['pid'], child['legacy_recid'])
-                )
-
-    titles = set()
-    search = SeriesSearch().filter('term', mode_of_issuance='SERIAL')
-    for serial_hit in search.scan():
-        # Store titles and check for duplicates
-        if 'title' in serial_hit and 'title' in serial_hit.title:
-            title = serial_hit.title.title
-            if title in titles:
-                current_app.logger.warning(
-                    'Serial title "{}" already exists'.format(title))
-            else:
-                titles.add(title)
-        # Check if any children are missing
-        children = serial_hit._migration.children
-        serial = Series.get_record_by_pid(serial_hit.pid)
-        validate_serial_relation(serial, children)
-
-    click.echo('Serial validation check done!')
-
-
-def validate_multipart_records():
-    """Validate that multiparts were migrated successfully.
-
-    Performs the following checks:
-    * Ensure all volumes of migrated multiparts were migrated
-    """
-    def validate_multipart_relation(multipart, volumes):
-        relations = multipart.relations.get().get('multipart_monograph', [])
-        titles = [volume['title'] for volume in volumes if 'title' in volume]
-        count = len(set(v['volume'] for v in volumes))
-        if count != len(relations):
-            click.echo(
-                '[Multipart {}] Incorrect number of volumes: {} '
-                '(expected {})'.format(multipart['pid'], len(relations), count)
-            )
-        for relation in relations:
-            child = Document.get_record_by_pid(
-                relation['pid'],
-                pid_type=relation['pid_type']
-            )
-            if child['title']['title'] not in titles:
-                click.echo(
-                    '[Multipart {}] Title "{}" does not exist in '
-                    'migration data'.format(
-                        multipart['pid'],
-                        child['title']['title']
-                    )
-                )
-
-    search = SeriesSearch().filter(
-        'term',
-        mode_of_issuance='MULTIPART_MONOGRAPH'
-    )
-    for multipart_hit in search.scan():
-        # Check if any child is missing
-        if 'volumes' in multipart_hit._migration:
-            volumes = multipart_hit._migration.volumes
-            multipart = Series.get_record_by_pid(multipart_hit.pid)
-            validate_multipart_relation(multipart, volumes)
-
-    click.echo('Multipart validation check done!')
@@ -14,6 +14,7 @@ from __future__ import absolute_import, print_function
 import json
 import os
 import re
+from contextlib import contextmanager
 
 import click
 import sqlalchemy
@@ -24,7 +25,63 @@ from invenio_db import db
 from cds_books.migrator.api import commit, import_documents_from_dump, \
     import_documents_from_record_file, import_parents_from_file, \
     link_and_create_multipart_volumes, link_documents_and_serials, \
-    reindex_pidtype, validate_multipart_records, validate_serial_records
+    reindex_pidtype
+from cds_books.migrator.handlers import collect_errors, summarize_errors
+from cds_books.migrator.profiling import profiler
+from cds_books.migrator.validation import validate_multiparts, \
+    validate_serials
+
+
+def validation_options(f):
+    """Add the deferred validation options to a migration command."""
+    f = click.option(
+        '--deferred-validation',
+        is_flag=True,
+        help='Validate all the records in a pool of workers before inserting '
+             'them, instead of one by one on insertion.',
+        default=False)(f)
+    return click.option(
+        '--validation-workers',
+        type=int,
+        help='Number of deferred validation workers (defaults to the number '
+             'of CPUs).',
+        default=None)(f)
+
+
+def profile_options(f):
+    """Add the stage profiling options to a migration command."""
+    f = click.option(
+        '--live-profile',
+        is_flag=True,
+        help='Show a live stage summary next to the progress bar.',
+        default=False)(f)
+    return profile_report_option(f)
+
+
+def profile_report_option(f):
+    """Add the profiling report option to a migration command."""
+    return click.option(
+        '--profile-report',
+        type=click.File('w'),
+        help='Write the stage profiling JSON report to this file instead of '
+             'printing it.',
+        default=None)(f)
+
+
+@contextmanager
+def profiled(profile_report=None, live_profile=False):
+    """Profile the wrapped migration stages and emit the JSON report."""
+    profiler.reset()
+    profiler.live = live_profile
+    try:
+        yield profiler
+    finally:
+        profiler.live = False
+        report = profiler.report()
+        if profile_report:
+            json.dump(report, profile_report, indent=2)
+        else:
+            click.echo(json.dumps(report, indent=2))
 
 
 @click.group()
@@ -45,12 +102,33 @@ def migration():
     '-i',
     help='Comma-separated list of legacy recids to include in the import',
     default=None)
+@click.option(
+    '--errors-file',
+    type=click.Path(dir_okay=False, writable=True),
+    help='JSON lines file collecting the conversion errors, overwritten on '
+         'each run (defaults to migration_errors.jsonl in the instance '
+         'folder).',
+    default=None)
+@validation_options
+@profile_options
 @with_appcontext
-def documents(sources, source_type, include):
+def documents(sources, source_type, include, errors_file, deferred_validation,
+              validation_workers, profile_report, live_profile):
     """Migrate documents from CDS legacy."""
-    with commit():
+    errors_file = errors_file or os.path.join(
+        current_app.instance_path, 'migration_errors.jsonl')
+    if os.path.exists(errors_file) and os.path.getsize(errors_file):
+        click.secho('Overwriting the errors of a previous run in {}'.format(
+            errors_file), fg='yellow')
+    with profiled(profile_report, live_profile), \
+            collect_errors(errors_file), commit():
         if source_type == 'migrator-kit':
-            import_documents_from_record_file(sources, include)
+            import_documents_from_record_file(
+                sources,
+                include,
+                deferred_validation=deferred_validation,
+                workers=validation_workers
+            )
         else:
             import_documents_from_dump(
                 sources=sources,
@@ -69,12 +147,21 @@ def documents(sources, source_type, include):
     help='Comma-separated list of legacy recids (for multiparts) or serial '
          'titles to include in the import',
     default=None)
+@validation_options
+@profile_options
 @with_appcontext
-def parents(rectype, source, include):
+def parents(rectype, source, include, deferred_validation, validation_workers,
+            profile_report, live_profile):
     """Migrate parents serials, multiparts or tags from dumps."""
     click.echo('Migrating {}s...'.format(rectype))
-    with commit():
-        import_parents_from_file(source, rectype=rectype, include=include)
+    with profiled(profile_report, live_profile), commit():
+        import_parents_from_file(
+            source,
+            rectype=rectype,
+            include=include,
+            deferred_validation=deferred_validation,
+            workers=validation_workers
+        )
 
 
 @migration.group()
@@ -83,23 +170,71 @@ def relations():
 
 
 @relations.command()
+@profile_report_option
 @with_appcontext
-def multipart():
+def multipart(profile_report):
     """Create relations for migrated multiparts."""
-    with commit():
-        link_and_create_multipart_volumes()
-    reindex_pidtype('docid')
-    reindex_pidtype('serid')
+    with profiled(profile_report):
+        with commit():
+            link_and_create_multipart_volumes()
+        reindex_pidtype('docid')
+        reindex_pidtype('serid')
 
 
 @relations.command()
+@profile_report_option
 @with_appcontext
-def serial():
+def serial(profile_report):
     """Create relations for migrated serials."""
-    with commit():
-        link_documents_and_serials()
-    reindex_pidtype('docid')
-    reindex_pidtype('serid')
+    with profiled(profile_report):
+        with commit():
+            link_documents_and_serials()
+        reindex_pidtype('docid')
+        reindex_pidtype('serid')
+
+
+@migration.group()
+def errors():
+    """Inspect the conversion errors of migrated documents."""
+
+
+@errors.command()
+@click.argument('errors_file', type=click.File('r'))
+@click.option(
+    '--json',
+    'as_json',
+    is_flag=True,
+    help='Output the summary as JSON.',
+    default=False)
+def summary(errors_file, as_json):
+    """Summarize the conversion errors by MARC field and error type."""
+    rows = summarize_errors(errors_file)
+    if as_json:
+        click.echo(json.dumps([
+            dict(field=field, error=error, count=count, records=records)
+            for field, error, count, records in rows
+        ], indent=2))
+        return
+    click.echo('{:<12} {:<28} {:>10} {:>10}'.format(
+        'FIELD', 'ERROR', 'COUNT', 'RECORDS'))
+    for field, error, count, records in rows:
+        click.echo('{:<12} {:<28} {:>10} {:>10}'.format(
+            str(field), error, count, records))
+
+
+def echo_validation_report(name, report, output=None):
+    """Print the validation errors and dump the JSON report to output."""
+    for title in report.get('duplicate_titles', []):
+        click.echo('[{}] Title "{}" is used by {} records'.format(
+            name.capitalize(), title['title'], title['count']))
+    for error in report['errors']:
+        details = {k: v for k, v in error.items() if k not in ('pid', 'check')}
+        click.echo('[{} {}] {}: {}'.format(
+            name.capitalize(), error['pid'], error['check'], details))
+    if output:
+        json.dump({name: report}, output, indent=2, sort_keys=True)
+    click.echo('{} validation check done! ({} checked, {} errors)'.format(
+        name.capitalize(), report['checked'], len(report['errors'])))
 
 
 @migration.group()
@@ -108,14 +243,26 @@ def validate():
 
 
 @validate.command(name='serial')
+@click.option(
+    '--report',
+    '-r',
+    type=click.File('w'),
+    help='Write the validation results as a JSON report to this file.',
+    default=None)
 @with_appcontext
-def validate_serial():
+def validate_serial(report):
     """Validate migrated serials."""
-    validate_serial_records()
+    echo_validation_report('serial', validate_serials(), report)
 
 
 @validate.command(name='multipart')
+@click.option(
+    '--report',
+    '-r',
+    type=click.File('w'),
+    help='Write the validation results as a JSON report to this file.',
+    default=None)
 @with_appcontext
-def validate_multipart():
+def validate_multipart(report):
     """Validate migrated multiparts."""
-    validate_multipart_records()
+    echo_validation_report('multipart', validate_multiparts(), report)
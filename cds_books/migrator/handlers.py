@@ -8,13 +8,128 @@
 
 """CDS Migrator Records logging handler."""
 
+import json
 import logging
+import queue
+import threading
+from collections import Counter
+from contextlib import contextmanager
 
 logger = logging.getLogger('migrator')
 
+ERROR_FIELDS = ('recid', 'field', 'error', 'message', 'value')
+"""Keys of each line written by the error sink."""
+
+
+class JSONLErrorSink(object):
+    """Buffered sink writing migration errors as JSON lines.
+
+    Errors are queued as tuples by the conversion and written in batches by a
+    background thread, so that no formatting or I/O happens on the hot path.
+    The queue is bounded: the conversion waits when the writer falls behind.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size=1000, max_pending=100000):
+        """Constructor."""
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.path = None
+        self._fp = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    @property
+    def is_open(self):
+        """Whether the sink is currently writing to a file."""
+        return self._thread is not None
+
+    def open(self, path):
+        """Start writing the queued errors to the given file.
+
+        The file is truncated, and opened right away so that an unwritable
+        path fails before the migration starts.
+        """
+        self.close()
+        self._fp = open(path, 'w')
+        self.path = path
+        self._error = None
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._thread = threading.Thread(
+            target=self._write_batches, name='migration-error-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Flush the pending errors and stop the writer thread.
+
+        Raises the error which stopped the writer thread, if any.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._fp.close()
+        self._thread = None
+        self._queue = None
+        self._fp = None
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def put(self, recid, field, error, message, value):
+        """Queue one error."""
+        self._queue.put((recid, field, error, message, value))
+
+    def _write_batches(self):
+        """Write the queued errors, one batch at a time.
+
+        After a write error the queue is still drained, so that the
+        conversion is never blocked, and the error is raised by `close`.
+        """
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is self._STOP:
+                stop = True
+                batch.pop()
+            if self._error is not None:
+                continue
+            try:
+                self._fp.write(''.join(
+                    json.dumps(dict(zip(ERROR_FIELDS, error)), default=str)
+                    + '\n' for error in batch
+                ))
+                self._fp.flush()
+            except Exception as e:
+                logger.error('Cannot write the migration errors to %s: %s',
+                             self.path, e)
+                self._error = e
+
+
+error_sink = JSONLErrorSink()
+"""Process-wide error sink used by the migration exception handler."""
+
+
+@contextmanager
+def collect_errors(path):
+    """Write the migration errors raised in the wrapped block to path."""
+    error_sink.open(path)
+    try:
+        yield error_sink
+    finally:
+        error_sink.close()
+
 
 def migration_exception_handler(exc, output, key, value, **kwargs):
-    """Migration exception handling - log to files.
+    """Migration exception handling - queue to the error sink.
 
     :param exc: exception
     :param output: generated output version
@@ -22,7 +137,31 @@ def migration_exception_handler(exc, output, key, value, **kwargs):
     :param value: MARC field value
     :return:
     """
-    logger.error(
-        '#RECID: #{0} - {1}  MARC FIELD: *{2}*, input value: {3}, -> {4}, '
-        .format(output['legacy_recid'], exc.message, key, value, output)
-    )
+    recid = output.get('legacy_recid')
+    message = getattr(exc, 'message', None) or str(exc)
+    if error_sink.is_open:
+        error_sink.put(recid, key, exc.__class__.__name__, message, value)
+    else:
+        logger.error('#RECID: #%s - %s  MARC FIELD: *%s*, input value: %s',
+                     recid, message, key, value)
+
+
+def summarize_errors(lines):
+    """Aggregate JSON lines errors by MARC field and error type.
+
+    :param lines: iterable of lines written by the error sink.
+    :return: list of ``(field, error, count, records)`` sorted by count.
+    """
+    counts = Counter()
+    records = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        error = json.loads(line)
+        group = (error['field'], error['error'])
+        counts[group] += 1
+        records.setdefault(group, set()).add(error['recid'])
+    return [
+        (field, error, count, len(records[(field, error)]))
+        for (field, error), count in counts.most_common()
+    ]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-books is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS-Books migrator stage profiling."""
+
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+STAGES = (
+    'marc_parse',
+    'dojson',
+    'access',
+    'deferred_validation',
+    'pid_minting',
+    'record_create',
+    'record_commit',
+    'relation',
+    'db_commit',
+    'indexing',
+)
+"""Known migration stages, in the order they are reported.
+
+``record_create`` times ``Record.create``, which validates and adds the
+record to the session, ``record_commit`` times ``Record.commit``, which
+validates and flushes the changes, and ``db_commit`` the database commits.
+"""
+
+
+def percentile(sorted_values, percent):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class StageProfiler(object):
+    """Collect the time spent in each stage of a migration command.
+
+    The time of a stage is summed over the migration of each record, e.g. the
+    parsing of all its revisions, and kept as one per-record sample. Stages
+    timed outside of a record, e.g. the bulk indexing, only count in the
+    stage totals.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.live = False
+        self.reset()
+
+    def reset(self):
+        """Forget all the collected timings."""
+        self.timings = OrderedDict((stage, []) for stage in STAGES)
+        self.totals = OrderedDict((stage, 0.0) for stage in STAGES)
+        self.records = 0
+        self._record = None
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Add the time spent in the wrapped block to the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.totals[name] = self.totals.get(name, 0.0) + elapsed
+            if self._record is not None:
+                self._record[name] = self._record.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def record(self):
+        """Profile the wrapped block as the migration of one record.
+
+        The stage samples of the record are kept when the block succeeds.
+        """
+        self._record = OrderedDict()
+        try:
+            yield
+        except BaseException:
+            self._record = None
+            raise
+        for name, seconds in self._record.items():
+            self.timings.setdefault(name, []).append(seconds)
+        self._record = None
+        self.records += 1
+
+    @property
+    def elapsed(self):
+        """Wall-clock seconds since the profiler was reset."""
+        return time.perf_counter() - self.started
+
+    def summary_line(self):
+        """Return a one line summary of the stage totals."""
+        elapsed = self.elapsed
+        stages = ' '.join(
+            '{}={:.1f}s'.format(name, total)
+            for name, total in self.totals.items() if total
+        )
+        return '{:.1f} rec/s {}'.format(
+            self.records / elapsed if elapsed else 0.0, stages)
+
+    def item_show_func(self, item):
+        """Progressbar hook displaying the live summary line if enabled."""
+        if self.live:
+            return self.summary_line()
+        return None
+
+    def report(self):
+        """Return the per-stage timings as a JSON serializable dict.
+
+        The percentiles are the seconds spent in the stage per record, and
+        ``records_per_second`` the records a stage alone would process.
+        """
+        elapsed = self.elapsed
+        stages = OrderedDict()
+        for name, total in self.totals.items():
+            if not total:
+                continue
+            ordered = sorted(self.timings.get(name, []))
+            record_total = sum(ordered)
+            throughput = len(ordered) / record_total if record_total else None
+            stages[name] = OrderedDict([
+                ('total_seconds', total),
+                ('share', total / elapsed if elapsed else 0.0),
+                ('records', len(ordered)),
+                ('records_per_second', throughput),
+                ('p50', percentile(ordered, 50)),
+                ('p95', percentile(ordered, 95)),
+                ('p99', percentile(ordered, 99)),
+            ])
+        return OrderedDict([
+            ('records', self.records),
+            ('elapsed_seconds', elapsed),
+            ('records_per_second', self.records / elapsed if elapsed else 0.0),
+            ('stages', stages),
+        ])
+
+
+profiler = StageProfiler()
+"""Process-wide profiler used by the migration commands."""
@@ -32,6 +32,8 @@ from invenio_records import Record
 
 from cds_books.migrator.errors import LossyConversion
 from cds_books.migrator.handlers import migration_exception_handler
+from cds_books.migrator.profiling import profiler
+from cds_books.migrator.schemas import CachedSchemaValidator
 from cds_books.migrator.utils import process_fireroles, update_access
 
 cli_logger = logging.getLogger('migrator')
@@ -75,7 +77,8 @@ class CDSRecordDump(RecordDump):
         dt = arrow.get(data['modification_datetime']).datetime
 
         if self.source_type == 'marcxml':
-            marc_record = create_record(data['marcxml'])
+            with profiler.stage('marc_parse'):
+                marc_record = create_record(data['marcxml'])
             return dt, marc_record
         else:
             val = data['json']
@@ -98,14 +101,17 @@ class CDSRecordDump(RecordDump):
         }
 
         if self.source_type == 'marcxml':
-            marc_record = create_record(data['marcxml'])
+            with profiler.stage('marc_parse'):
+                marc_record = create_record(data['marcxml'])
             try:
-                val = self.dojson_model.do(
-                    marc_record, exception_handlers=exception_handlers)
-                missing = self.dojson_model.missing(marc_record)
+                with profiler.stage('dojson'):
+                    val = self.dojson_model.do(
+                        marc_record, exception_handlers=exception_handlers)
+                    missing = self.dojson_model.missing(marc_record)
                 if missing:
                     raise LossyConversion(missing=missing)
-                update_access(val, self.collection_access)
+                with profiler.stage('access'):
+                    update_access(val, self.collection_access)
                 return dt, val
             except LossyConversion as e:
                 raise e
@@ -118,7 +124,8 @@ class CDSRecordDump(RecordDump):
             val = data['json']
 
             # Calculate the _access key
-            update_access(val, self.collection_access)
+            with profiler.stage('access'):
+                update_access(val, self.collection_access)
             return dt, val
 
     def prepare_revisions(self):
@@ -163,26 +170,31 @@ class CDSParentRecordDumpLoader(RecordDumpLoader):
     """Migrate a CDS parent records."""
 
     @classmethod
-    def create(cls, dump, model, pid_provider):
+    def create(cls, dump, model, pid_provider,
+               validator=CachedSchemaValidator):
         """Create record based on dump."""
-        record = cls.create_record(dump, model, pid_provider)
+        record = cls.create_record(dump, model, pid_provider, validator)
         return record
 
     @classmethod
     @disable_timestamp
-    def create_record(cls, dump, model, pid_provider):
+    def create_record(cls, dump, model, pid_provider,
+                      validator=CachedSchemaValidator):
         """Create a new record from dump."""
         # Reserve record identifier, create record and recid pid in one
         # operation.
         record_uuid = uuid.uuid4()
-        provider = pid_provider.create(
-            object_type='rec',
-            object_uuid=record_uuid,
-        )
+        with profiler.stage('pid_minting'):
+            provider = pid_provider.create(
+                object_type='rec',
+                object_uuid=record_uuid,
+            )
         dump['pid'] = provider.pid.pid_value
-        record = model.create(dump, record_uuid)
+        with profiler.stage('record_create'):
+            record = model.create(dump, record_uuid, validator=validator)
         record.model.created = datetime.datetime.utcnow()
-        record.commit()
+        with profiler.stage('record_commit'):
+            record.commit(validator=validator)
         return record
 
 
@@ -229,19 +241,26 @@ class CDSDocumentDumpLoader(RecordDumpLoader):
         # Reserve record identifier, create record and recid pid in one
         # operation.
         timestamp, data = dump.latest
-        record = Record.create(data)
+        with profiler.stage('record_create'):
+            record = Record.create(data, validator=CachedSchemaValidator)
         record_uuid = uuid.uuid4()
-        provider = DocumentIdProvider.create(
-            object_type='rec',
-            object_uuid=record_uuid,
-        )
+        with profiler.stage('pid_minting'):
+            provider = DocumentIdProvider.create(
+                object_type='rec',
+                object_uuid=record_uuid,
+            )
         timestamp, json_data = dump.rest[-1]
         json_data['pid'] = provider.pid.pid_value
         record.model.json = json_data
         record.model.created = dump.created.replace(tzinfo=None)
         record.model.updated = timestamp.replace(tzinfo=None)
-        document = Document.create(record.model.json, record_uuid)
-        document.commit()
-        db.session.commit()
+        with profiler.stage('record_create'):
+            document = Document.create(
+                record.model.json, record_uuid,
+                validator=CachedSchemaValidator)
+        with profiler.stage('record_commit'):
+            document.commit(validator=CachedSchemaValidator)
+        with profiler.stage('db_commit'):
+            db.session.commit()
 
         return document
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-books is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS-Books migrator JSON schema validation.
+
+Migrated records are validated with compiled validators cached by schema URL,
+instead of resolving the ``$schema`` of every record again. The validator
+classes below are meant to be passed as the ``validator`` argument of both
+``Record.create`` and ``Record.commit``, which otherwise validates again with
+the default validator.
+"""
+
+import json
+import multiprocessing
+
+from flask import current_app
+from invenio_jsonschemas import current_jsonschemas
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+PLACEHOLDER_PID = '0'
+"""PID used to validate records before their PID is minted."""
+
+_validators = {}
+
+_worker_validator = None
+
+
+def schema_url(model):
+    """Return the JSON schema URL of a record class."""
+    return current_jsonschemas.path_to_url(model._schema)
+
+
+def resolve_schema(url):
+    """Return the schema at the given URL with all its $ref resolved."""
+    path = current_jsonschemas.url_to_path(url)
+    schema = current_jsonschemas.get_schema(
+        path, with_refs=True, resolved=True)
+    # Get rid of the lazy JSON references
+    return json.loads(json.dumps(schema))
+
+
+def compile_validator(schema, format_checker=None, types=None):
+    """Return a validator instance for a resolved schema.
+
+    :param types: additional JSON types, as ``RECORDS_VALIDATION_TYPES``.
+    """
+    cls = validator_for(schema, default=Draft4Validator)
+    cls.check_schema(schema)
+    kwargs = dict(format_checker=format_checker)
+    if types:
+        kwargs['types'] = types
+    return cls(schema, **kwargs)
+
+
+def get_validator(url, format_checker=None, types=None):
+    """Return the cached compiled validator of a schema URL."""
+    key = (url, format_checker, tuple(sorted((types or {}).items())))
+    validator = _validators.get(key)
+    if validator is None:
+        validator = compile_validator(
+            resolve_schema(url), format_checker, types)
+        _validators[key] = validator
+    return validator
+
+
+def clear_validators():
+    """Forget all the compiled validators."""
+    _validators.clear()
+
+
+class CachedSchemaValidator(object):
+    """Validator class returning the cached validator of a record schema."""
+
+    @classmethod
+    def check_schema(cls, schema):
+        """Schemas are checked once, when their validator is compiled."""
+
+    def __new__(cls, schema, *args, **kwargs):
+        """Return the compiled validator instead of a new instance.
+
+        The schema given by ``invenio-records`` is ``{'$ref': <url>}``, the
+        reference resolver it builds for each record is not needed.
+        """
+        return get_validator(
+            schema['$ref'],
+            format_checker=kwargs.get('format_checker'),
+            types=kwargs.get('types'),
+        )
+
+
+class PrevalidatedValidator(object):
+    """Validator class for records already validated in deferred mode."""
+
+    @classmethod
+    def check_schema(cls, schema):
+        """No schema check needed."""
+
+    def __init__(self, schema, *args, **kwargs):
+        """Constructor."""
+
+    def iter_errors(self, instance):
+        """Report no errors."""
+        return iter(())
+
+    def validate(self, instance):
+        """Accept every instance."""
+
+
+def _init_worker(schema, types):
+    """Compile the schema validator of a worker process."""
+    global _worker_validator
+    _worker_validator = compile_validator(schema, types=types)
+
+
+def _validate_batch(batch):
+    """Return the (index, message) of the invalid records of a batch."""
+    errors = []
+    for index, data in batch:
+        error = best_match(_worker_validator.iter_errors(data))
+        if error is not None:
+            errors.append((index, error.message))
+    return errors
+
+
+def validate_deferred(dumps, model, workers=None, batch_size=500):
+    """Validate whole batches of records in a pool of worker processes.
+
+    :param dumps: list of records to validate.
+    :param model: record class the dumps will be created with.
+    :param workers: number of worker processes (defaults to the CPU count).
+    :param batch_size: number of records sent to a worker at once.
+    :return: dictionary of dump index to validation error message.
+    """
+    url = schema_url(model)
+    schema = resolve_schema(url)
+    types = current_app.config.get('RECORDS_VALIDATION_TYPES', {})
+
+    def batches():
+        batch = []
+        for index, dump in enumerate(dumps):
+            data = dict(dump)
+            data['$schema'] = url
+            data.setdefault('pid', PLACEHOLDER_PID)
+            batch.append((index, data))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    errors = {}
+    with multiprocessing.Pool(workers, _init_worker,
+                              (schema, types)) as pool:
+        for batch_errors in pool.imap_unordered(_validate_batch, batches()):
+            errors.update(batch_errors)
+    return errors
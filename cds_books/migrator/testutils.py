@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-books is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Synthetic CDS legacy dumps used to test and benchmark the migrator.
+
+The generated dumps follow the formats consumed by the ``migration`` CLI:
+
+* document dumps are lists of legacy records with several revisions, each
+  revision carrying both a ``marcxml`` and a ``json`` representation so that
+  they can be loaded with any ``--source-type``;
+* serial and multipart dumps are dictionaries of parent records keyed by
+  serial title and legacy recid respectively, as loaded by
+  ``migration parents``.
+"""
+
+import datetime
+import json
+import os
+import random
+from xml.sax.saxutils import escape
+
+MARCXML_RECORD = """<record>
+  <controlfield tag="001">{recid}</controlfield>
+  <controlfield tag="005">{modified}</controlfield>
+  <datafield tag="020" ind1=" " ind2=" ">
+    <subfield code="a">{isbn}</subfield>
+  </datafield>
+  <datafield tag="041" ind1=" " ind2=" ">
+    <subfield code="a">eng</subfield>
+  </datafield>
+  <datafield tag="100" ind1=" " ind2=" ">
+    <subfield code="a">{author}</subfield>
+  </datafield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">{title}</subfield>
+  </datafield>
+  <datafield tag="260" ind1=" " ind2=" ">
+    <subfield code="b">{publisher}</subfield>
+    <subfield code="c">{year}</subfield>
+  </datafield>
+{serials}  <datafield tag="690" ind1="C" ind2=" ">
+    <subfield code="a">BOOK</subfield>
+  </datafield>
+  <datafield tag="980" ind1=" " ind2=" ">
+    <subfield code="a">BOOK</subfield>
+  </datafield>
+</record>
+"""
+
+MARCXML_SERIAL = """  <datafield tag="490" ind1=" " ind2=" ">
+    <subfield code="a">{title}</subfield>
+    <subfield code="v">{volume}</subfield>
+  </datafield>
+"""
+
+WORDS = (
+    'physics', 'particle', 'quantum', 'field', 'theory', 'accelerator',
+    'detector', 'computing', 'introduction', 'advanced', 'methods', 'data',
+    'analysis', 'relativity', 'cosmology', 'nuclear', 'collider', 'beam',
+)
+
+
+class DumpGenerator(object):
+    """Generate reproducible synthetic CDS legacy dumps.
+
+    :param documents: number of legacy documents.
+    :param serials: number of serials, each one gets a share of the documents.
+    :param multiparts: number of multipart documents.
+    :param volumes: number of volumes of each multipart.
+    :param revisions: number of revisions of each document.
+    :param seed: seed of the random generator.
+    :param start_recid: first legacy recid.
+    """
+
+    def __init__(self, documents=1000, serials=50, multiparts=50, volumes=3,
+                 revisions=3, seed=0, start_recid=1):
+        """Constructor."""
+        self.documents = documents
+        self.serials = serials
+        self.multiparts = min(multiparts, documents)
+        self.volumes = volumes
+        self.revisions = revisions
+        self.start_recid = start_recid
+        self.random = random.Random(seed)
+        self._assign_relations()
+
+    @property
+    def recids(self):
+        """Legacy recids of the generated documents."""
+        return range(self.start_recid, self.start_recid + self.documents)
+
+    def _words(self, count):
+        """Return a random title-cased sentence."""
+        return ' '.join(
+            self.random.choice(WORDS) for _ in range(count)).title()
+
+    def _assign_relations(self):
+        """Decide which documents belong to serials or are multiparts."""
+        recids = list(self.recids)
+        self.serial_titles = [
+            '{} Series {}'.format(self._words(2), idx)
+            for idx in range(self.serials)
+        ]
+        self.serial_children = {title: [] for title in self.serial_titles}
+        self.document_serials = {}
+        for recid in recids:
+            if self.serial_titles and self.random.random() < 0.3:
+                title = self.random.choice(self.serial_titles)
+                volume = str(len(self.serial_children[title]) + 1)
+                self.serial_children[title].append(recid)
+                self.document_serials[recid] = [
+                    dict(title=title, volume=volume)]
+        self.multipart_recids = set(
+            self.random.sample(recids, self.multiparts))
+
+    def _multipart_title(self, recid):
+        """Return the title shared by a multipart and its volumes."""
+        return 'Multipart {}'.format(recid)
+
+    def _multipart_volumes(self, title):
+        """Return the ``_migration.volumes`` of a multipart."""
+        return [
+            dict(volume=str(number), title='{} vol. {}'.format(title, number))
+            for number in range(1, self.volumes + 1)
+        ]
+
+    def _document_json(self, recid, title, author):
+        """Return the JSON representation of a legacy document."""
+        serials = self.document_serials.get(recid, [])
+        is_multipart = recid in self.multipart_recids
+        return {
+            'legacy_recid': recid,
+            'title': {'title': title},
+            'authors': [{'full_name': author}],
+            'languages': ['ENG'],
+            '_migration': {
+                'has_serial': bool(serials),
+                'serials': serials,
+                'is_multipart': is_multipart,
+                'volumes': self._multipart_volumes(title)
+                if is_multipart else [],
+            },
+        }
+
+    def _marcxml(self, recid, title, author, modified):
+        """Return the MARCXML representation of a legacy document."""
+        serials = ''.join(
+            MARCXML_SERIAL.format(
+                title=escape(serial['title']), volume=serial['volume'])
+            for serial in self.document_serials.get(recid, [])
+        )
+        return MARCXML_RECORD.format(
+            recid=recid,
+            modified=modified.strftime('%Y%m%d%H%M%S.0'),
+            isbn='978-{:010d}'.format(recid),
+            author=escape(author),
+            title=escape(title),
+            publisher='CERN',
+            year=modified.year,
+            serials=serials,
+        )
+
+    def document(self, recid):
+        """Return the legacy dump of one document."""
+        if recid in self.multipart_recids:
+            title = self._multipart_title(recid)
+        else:
+            title = self._words(4)
+        author = '{}, {}'.format(self._words(1), self._words(1))
+        created = datetime.datetime(2000, 1, 1) + datetime.timedelta(
+            days=self.random.randint(0, 6000))
+        revisions = []
+        for idx in range(self.revisions):
+            modified = created + datetime.timedelta(days=30 * idx)
+            revisions.append({
+                'modification_datetime': modified.isoformat(),
+                'marcxml': self._marcxml(recid, title, author, modified),
+                'json': self._document_json(recid, title, author),
+            })
+        return {
+            'recid': recid,
+            'record': revisions,
+            'collections': {'original': ['BOOK'], 'restricted': {}},
+            'files': [],
+        }
+
+    def iter_documents(self):
+        """Iterate over the legacy dumps of all documents."""
+        for recid in self.recids:
+            yield self.document(recid)
+
+    def serials_dump(self):
+        """Return the serials dump, keyed by serial title."""
+        return {
+            title: {
+                'title': {'title': title},
+                'mode_of_issuance': 'SERIAL',
+                '_migration': {'children': children},
+            }
+            for title, children in self.serial_children.items()
+        }
+
+    def multiparts_dump(self):
+        """Return the multiparts dump, keyed by legacy recid."""
+        dump = {}
+        for recid in sorted(self.multipart_recids):
+            title = self._multipart_title(recid)
+            dump[str(recid)] = {
+                'legacy_recid': recid,
+                'title': {'title': title},
+                'mode_of_issuance': 'MULTIPART_MONOGRAPH',
+                '_migration': {'volumes': self._multipart_volumes(title)},
+            }
+        return dump
+
+    def write(self, directory):
+        """Write the dumps as JSON files in the given directory.
+
+        :return: a dictionary with the paths of the ``documents``, ``serials``
+            and ``multiparts`` dumps.
+        """
+        dumps = dict(
+            documents=list(self.iter_documents()),
+            serials=self.serials_dump(),
+            multiparts=self.multiparts_dump(),
+        )
+        paths = {}
+        for name, dump in dumps.items():
+            paths[name] = os.path.join(directory, '{}.json'.format(name))
+            with open(paths[name], 'w') as fp:
+                json.dump(dump, fp)
+        return paths
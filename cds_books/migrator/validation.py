@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2019 CERN.
+#
+# cds-books is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS-Books migrator validation engine.
+
+The checks are computed with Elasticsearch aggregations and batched
+multi-searches instead of loading every migrated record from the database.
+"""
+
+from elasticsearch_dsl import A, MultiSearch, Q
+from invenio_app_ils.search.api import DocumentSearch, SeriesSearch
+from invenio_search import current_search_client
+
+SERIAL_TITLE_FIELD = 'title.title.keyword'
+DOCUMENT_TITLE_FIELD = 'title.title.keyword'
+SERIAL_RELATION_FIELD = 'relations.serial.pid'
+MULTIPART_RELATION_FIELD = 'relations.multipart_monograph.pid'
+
+AGGREGATION_PAGE_SIZE = 1000
+MSEARCH_BATCH_SIZE = 100
+MAX_REPORTED_VALUES = 20
+
+
+def _composite_buckets(search, field, page_size=AGGREGATION_PAGE_SIZE):
+    """Iterate over all the (key, doc_count) buckets of a terms field.
+
+    A composite aggregation is used to page through the buckets so that the
+    number of distinct values is not limited by the terms aggregation size.
+    """
+    after = None
+    while True:
+        params = dict(
+            sources=[{'key': A('terms', field=field)}],
+            size=page_size
+        )
+        if after:
+            params['after'] = after
+        paged = search.extra(size=0)
+        paged.aggs.bucket('buckets', 'composite', **params)
+        aggregation = paged.execute().aggregations.buckets
+        for bucket in aggregation.buckets:
+            yield bucket.key.key, bucket.doc_count
+        after = getattr(aggregation, 'after_key', None)
+        if not aggregation.buckets or not after:
+            break
+        after = after.to_dict()
+
+
+def _msearch(searches, batch_size=MSEARCH_BATCH_SIZE):
+    """Execute (key, search) pairs in batched multi-searches."""
+    batch = []
+
+    def _execute(batch):
+        msearch = MultiSearch(using=current_search_client)
+        for _, search in batch:
+            msearch = msearch.add(search)
+        for (key, _), response in zip(batch, msearch.execute()):
+            yield key, response
+
+    for key, search in searches:
+        batch.append((key, search))
+        if len(batch) >= batch_size:
+            for result in _execute(batch):
+                yield result
+            batch = []
+    if batch:
+        for result in _execute(batch):
+            yield result
+
+
+def _children_search():
+    """Search over all the records that can be children of a series."""
+    return DocumentSearch().index(*SeriesSearch()._index).filter(
+        'bool', must_not=[Q('term', mode_of_issuance='SERIAL')]
+    )
+
+
+def find_duplicate_serial_titles():
+    """Return the serial titles that are used by more than one serial."""
+    search = SeriesSearch().filter('term', mode_of_issuance='SERIAL')
+    return [
+        dict(title=title, count=count)
+        for title, count in _composite_buckets(search, SERIAL_TITLE_FIELD)
+        if count > 1
+    ]
+
+
+def count_children_by_parent(relation_field):
+    """Return a dictionary of parent PID to number of related children."""
+    return dict(_composite_buckets(_children_search(), relation_field))
+
+
+def validate_serials():
+    """Validate that serials were migrated successfully.
+
+    Performs the following checks:
+    * Find duplicate serial titles
+    * Ensure all children of migrated serials were migrated
+    * Ensure no unexpected children were linked to a serial
+
+    :return: a JSON serializable report.
+    """
+    duplicates = find_duplicate_serial_titles()
+    relation_counts = count_children_by_parent(SERIAL_RELATION_FIELD)
+
+    search = SeriesSearch().filter(
+        'term', mode_of_issuance='SERIAL'
+    ).source(['pid', '_migration.children'])
+
+    errors = []
+    serials = {}
+    for hit in search.scan():
+        migration = hit.to_dict().get('_migration', {})
+        children = migration.get('children', [])
+        serials[hit.pid] = children
+        found = relation_counts.get(hit.pid, 0)
+        if found != len(children):
+            errors.append(dict(
+                pid=hit.pid,
+                check='children_count',
+                expected=len(children),
+                found=found
+            ))
+
+    def unexpected_children_searches():
+        for pid, children in serials.items():
+            search = _children_search().filter(
+                'term', **{SERIAL_RELATION_FIELD: pid}
+            ).filter(
+                'exists', field='legacy_recid'
+            ).exclude(
+                'terms', legacy_recid=children
+            ).source(['legacy_recid']).extra(size=MAX_REPORTED_VALUES)
+            yield pid, search
+
+    for pid, response in _msearch(unexpected_children_searches()):
+        recids = [hit.legacy_recid for hit in response.hits]
+        if recids:
+            errors.append(dict(
+                pid=pid,
+                check='unexpected_children',
+                legacy_recids=recids
+            ))
+
+    return dict(
+        checked=len(serials),
+        duplicate_titles=duplicates,
+        errors=errors
+    )
+
+
+def validate_multiparts():
+    """Validate that multiparts were migrated successfully.
+
+    Performs the following checks:
+    * Ensure all volumes of migrated multiparts were migrated
+    * Ensure the volume titles exist in the migration data
+
+    :return: a JSON serializable report.
+    """
+    relation_counts = count_children_by_parent(MULTIPART_RELATION_FIELD)
+
+    search = SeriesSearch().filter(
+        'term', mode_of_issuance='MULTIPART_MONOGRAPH'
+    ).source(['pid', '_migration.volumes'])
+
+    errors = []
+    multiparts = {}
+    checked = 0
+    for hit in search.scan():
+        checked += 1
+        volumes = hit.to_dict().get('_migration', {}).get('volumes')
+        if not volumes:
+            continue
+        multiparts[hit.pid] = [
+            volume['title'] for volume in volumes if 'title' in volume
+        ]
+        expected = len(set(volume['volume'] for volume in volumes))
+        found = relation_counts.get(hit.pid, 0)
+        if found != expected:
+            errors.append(dict(
+                pid=hit.pid,
+                check='volumes_count',
+                expected=expected,
+                found=found
+            ))
+
+    def unknown_titles_searches():
+        for pid, titles in multiparts.items():
+            search = DocumentSearch().filter(
+                'term', **{MULTIPART_RELATION_FIELD: pid}
+            ).exclude(
+                'terms', **{DOCUMENT_TITLE_FIELD: titles}
+            ).source(['pid', 'title']).extra(size=MAX_REPORTED_VALUES)
+            yield pid, search
+
+    for pid, response in _msearch(unknown_titles_searches()):
+        titles = [hit.title.title for hit in response.hits]
+        if titles:
+            errors.append(dict(
+                pid=pid,
+                check='unknown_volume_titles',
+                titles=titles
+            ))
+
+    return dict(checked=checked, errors=errors)
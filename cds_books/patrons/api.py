@@ -12,9 +12,18 @@ from __future__ import absolute_import, print_function
 from flask import current_app
 from invenio_accounts.models import User
 from invenio_app_ils.records.api import Patron as ILSPatron
+from invenio_db import db
 from invenio_oauthclient.models import RemoteAccount
 from invenio_userprofiles.api import UserProfile
 
+_NOT_LOADED = object()
+
+
+def get_client_id():
+    """Return the client id of the CERN remote accounts."""
+    return current_app.config.get(
+        "CERN_APP_CREDENTIALS", {}).get("consumer_key") or "CLIENT_ID"
+
 
 class Patron(ILSPatron):
     """Patron record class."""
@@ -24,16 +33,32 @@ class Patron(ILSPatron):
     # Fake schema used to identify pid type from ES hit
     _schema = "patrons/patron-v1.0.0.json"
 
-    def __init__(self, id, revision_id=None):
-        """Create a `Patron` instance."""
+    def __init__(self, id, revision_id=None, extra_info=_NOT_LOADED):
+        """Create a `Patron` instance.
+
+        :param extra_info: the remote account ``extra_data`` of the patron,
+            when already fetched, e.g. by `get_patrons`.
+        """
         super(Patron, self).__init__(id, revision_id)
 
-        client_id = current_app.config.get(
-                "CERN_APP_CREDENTIALS", {}).get("consumer_key") or "CLIENT_ID"
-        remote_user = RemoteAccount.get(id, client_id)
-        self.extra_info = None
-        if remote_user:
-            self.extra_info = remote_user.extra_data
+        if extra_info is _NOT_LOADED:
+            remote_user = RemoteAccount.get(id, get_client_id())
+            extra_info = remote_user.extra_data if remote_user else None
+        self.extra_info = extra_info
+
+    @classmethod
+    def get_patrons(cls, ids):
+        """Return the patrons of the given user ids.
+
+        The remote accounts of all the patrons are fetched with one query.
+        """
+        ids = list(ids)
+        extra_data = dict(
+            db.session.query(RemoteAccount.user_id, RemoteAccount.extra_data)
+            .filter(RemoteAccount.user_id.in_(ids),
+                    RemoteAccount.client_id == get_client_id())
+        )
+        return [cls(id, extra_info=extra_data.get(id)) for id in ids]
 
     def dumps(self):
         """Return python representation of Patron metadata."""
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books Patron loans caches."""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+
+from invenio_app_ils.pidstore.pids import LOCATION_PID_TYPE
+from invenio_app_ils.records.api import Location
+from invenio_cache import current_cache
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+
+CHANGED_CACHES_KEY = "cds_books_changed_location_caches"
+"""Session info key of the location caches to invalidate on commit."""
+
+
+class LocationCache(object):
+    """Process-wide cache of all the `Location` records, keyed by pid.
+
+    The locations are loaded together, with a single query, and reloaded
+    once the TTL expires or after a location change is committed in this
+    process. Other processes see the change when their own TTL expires.
+    """
+
+    def __init__(self, ttl=3600):
+        """Constructor."""
+        self.ttl = ttl
+        self._locations = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Fetch all the locations from the database."""
+        rows = db.session.query(
+            PersistentIdentifier.pid_value, RecordMetadata.json
+        ).join(
+            RecordMetadata,
+            RecordMetadata.id == PersistentIdentifier.object_uuid
+        ).filter(
+            PersistentIdentifier.pid_type == LOCATION_PID_TYPE,
+            PersistentIdentifier.status == PIDStatus.REGISTERED,
+        )
+        return {pid: data for pid, data in rows}
+
+    def warm(self):
+        """Load the locations now."""
+        locations = self.load()
+        with self._lock:
+            self._locations = locations
+            self._expires = time.monotonic() + self.ttl
+
+    def invalidate(self):
+        """Forget the locations, they are loaded again on the next access."""
+        with self._lock:
+            self._locations = None
+
+    def get(self, pid):
+        """Return the location with the given pid, ``None`` if not found."""
+        locations = self._locations
+        if locations is None or time.monotonic() >= self._expires:
+            self.warm()
+            locations = self._locations
+        return locations.get(pid)
+
+    def on_record_change(self, sender, record=None, **kwargs):
+        """Invalidate the cache once the location change is committed.
+
+        Invalidating it right away would let a load before the commit cache
+        the previous locations again.
+        """
+        if isinstance(record, Location) or (
+                record is not None and
+                record.get("$schema", "").endswith(Location._schema)):
+            db.session.info.setdefault(CHANGED_CACHES_KEY, set()).add(self)
+
+    def on_commit(self, session):
+        """Invalidate the cache if the committed session changed a location."""
+        changed = session.info.get(CHANGED_CACHES_KEY)
+        if changed and self in changed:
+            changed.discard(self)
+            self.invalidate()
+
+
+class PatronCache(object):
+    """Cache of the indexed patrons by person id.
+
+    The patrons are stored in the shared Invenio cache, so that the ldap
+    synchronization and the patron indexing can invalidate them from any
+    process, see `cds_books.patrons.indexer`.
+    """
+
+    key_prefix = "cds_books:patron:"
+
+    def __init__(self, ttl=300):
+        """Constructor."""
+        self.ttl = ttl
+
+    def key(self, person_id):
+        """Return the cache key of a person id."""
+        return "{}{}".format(self.key_prefix, person_id)
+
+    def get(self, person_id):
+        """Return the cached patron source, ``None`` if not cached."""
+        return current_cache.get(self.key(person_id))
+
+    def set(self, person_id, patron):
+        """Cache the patron source of a person id."""
+        current_cache.set(self.key(person_id), patron, timeout=self.ttl)
+
+    def invalidate(self, person_ids):
+        """Forget the patrons of the given person ids."""
+        keys = [self.key(person_id) for person_id in person_ids if person_id]
+        if keys:
+            current_cache.delete_many(*keys)
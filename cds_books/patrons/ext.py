@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books Patrons extension."""
+
+from __future__ import absolute_import, print_function
+
+from invenio_db import db
+from invenio_records.signals import after_record_delete, \
+    after_record_insert, after_record_update
+from sqlalchemy import event
+
+from .cache import LocationCache, PatronCache
+
+
+class CDSBooksPatrons(object):
+    """CDS Books Patrons extension."""
+
+    def __init__(self, app=None):
+        """Extension initialization."""
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Flask application initialization."""
+        app.config.setdefault("CDS_BOOKS_LOCATIONS_CACHE_TTL", 3600)
+        self.location_cache = LocationCache(
+            ttl=app.config["CDS_BOOKS_LOCATIONS_CACHE_TTL"])
+        for signal in (after_record_insert, after_record_update,
+                       after_record_delete):
+            signal.connect(self.location_cache.on_record_change,
+                           weak=False)
+        event.listen(db.session, "after_commit", self.location_cache.on_commit)
+
+        app.config.setdefault("CDS_BOOKS_PATRON_CACHE_TTL", 300)
+        self.patron_cache = PatronCache(
+            ttl=app.config["CDS_BOOKS_PATRON_CACHE_TTL"])
+
+        @app.before_first_request
+        def warm_location_cache():
+            """Load the locations before serving the first request."""
+            self.location_cache.warm()
+
+        app.extensions["cds-books-patrons"] = self
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books Patron indexer."""
+
+from __future__ import absolute_import, print_function
+
+from elasticsearch.helpers import bulk
+from invenio_accounts.models import User
+from invenio_app_ils.indexer import PatronsIndexer
+from invenio_db import db
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+
+from .api import Patron
+from .proxies import current_patron_cache
+
+
+def invalidate_cached_patrons(index, person_ids):
+    """Invalidate the cached patrons once the bulk changes are searchable.
+
+    The index is refreshed once per bulk run. Invalidating the patrons
+    before the refresh would let a search cache their previous version
+    again.
+    """
+    person_ids = [person_id for person_id in person_ids if person_id]
+    if person_ids:
+        current_search_client.indices.refresh(index=index)
+        current_patron_cache.invalidate(person_ids)
+
+
+class PatronIndexer(PatronsIndexer):
+    """Patrons indexer invalidating the cached version of the patrons.
+
+    The index is not refreshed on each write: a search before the next
+    refresh can cache the previous version of a patron again, for at most
+    ``CDS_BOOKS_PATRON_CACHE_TTL``.
+    """
+
+    def index(self, record, *args, **kwargs):
+        """Index a patron, then invalidate its cached version."""
+        result = super(PatronIndexer, self).index(record, *args, **kwargs)
+        current_patron_cache.invalidate([record.dumps().get("person_id")])
+        return result
+
+    def delete(self, record, *args, **kwargs):
+        """Delete a patron from the index, then invalidate its cache."""
+        result = super(PatronIndexer, self).delete(record, *args, **kwargs)
+        current_patron_cache.invalidate([record.dumps().get("person_id")])
+        return result
+
+
+def bulk_index_patrons(user_ids, chunk_size=500):
+    """Index the patrons of the given user ids with bulk requests.
+
+    The patrons of each chunk are loaded together with `Patron.get_patrons`
+    and their cached version is invalidated after the index refresh.
+
+    :return: the number of indexed patrons.
+    """
+    index = build_alias_name(Patron._index)
+    user_ids = list(user_ids)
+
+    def patrons():
+        for start in range(0, len(user_ids), chunk_size):
+            for patron in Patron.get_patrons(
+                    user_ids[start:start + chunk_size]):
+                yield patron
+
+    person_ids = []
+
+    def actions():
+        for patron in patrons():
+            dump = patron.dumps()
+            person_ids.append(dump.get("person_id"))
+            yield {
+                "_op_type": "index",
+                "_index": index,
+                "_id": patron.id,
+                "_source": dump,
+            }
+
+    indexed, _ = bulk(
+        current_search_client,
+        actions(),
+        chunk_size=chunk_size,
+        stats_only=True
+    )
+    invalidate_cached_patrons(index, person_ids)
+    return indexed
+
+
+def bulk_index_all_patrons(chunk_size=500):
+    """Index the patrons of all the active users with bulk requests.
+
+    The deactivated users, e.g. removed from ldap, are not indexed.
+
+    :return: the number of indexed patrons.
+    """
+    user_ids = [
+        id for id, in db.session.query(User.id).filter(
+            User.active.is_(True)).order_by(User.id)
+    ]
+    return bulk_index_patrons(user_ids, chunk_size=chunk_size)
+
+
+def bulk_delete_patrons(user_ids, person_ids=(), chunk_size=500):
+    """Delete the patrons of the given user ids from the index.
+
+    Patrons which are not indexed are ignored. The cached patrons of the
+    given person ids are invalidated after the index refresh.
+
+    :return: the number of deleted patrons.
+    """
+    index = build_alias_name(Patron._index)
+    actions = (
+        {"_op_type": "delete", "_index": index, "_id": user_id}
+        for user_id in user_ids
+    )
+    deleted, _ = bulk(
+        current_search_client,
+        actions,
+        chunk_size=chunk_size,
+        stats_only=True,
+        raise_on_error=False
+    )
+    invalidate_cached_patrons(index, person_ids)
+    return deleted
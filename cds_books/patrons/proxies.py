@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""CDS Books Patrons proxies."""
+
+from __future__ import absolute_import, print_function
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+current_location_cache = LocalProxy(
+    lambda: current_app.extensions["cds-books-patrons"].location_cache)
+"""Cache of the `Location` records."""
+
+current_patron_cache = LocalProxy(
+    lambda: current_app.extensions["cds-books-patrons"].patron_cache)
+"""Cache of the indexed patrons by person id."""
@@ -8,32 +8,72 @@
 """Invenio App ILS Patron Loans Information views."""
 
 from flask import Response, jsonify, url_for
-from invenio_app_ils.records.api import Document, Location
+from invenio_app_ils.search.api import DocumentSearch
 
+from .proxies import current_location_cache
 
-def serialize_on_loan_book_information(loan):
+
+def get_records_by_pid(search_cls, pids, fields):
+    """Return the given fields of the indexed records, keyed by pid.
+
+    All the records are fetched with a single search.
+    """
+    pids = list(set(pids))
+    if not pids:
+        return {}
+    search = search_cls().filter("terms", pid=pids).source(
+        ["pid"] + list(fields))[:len(pids)]
+    return {hit.pid: hit.to_dict() for hit in search.execute()}
+
+
+class LoanRecordsLoader(object):
+    """Documents and locations of a list of loans.
+
+    The documents are loaded in batch, the locations come from the
+    process-wide location cache.
+    """
+
+    def __init__(self, loans):
+        """Load the documents of all the loans at once."""
+        self.documents = get_records_by_pid(
+            DocumentSearch,
+            (loan["document_pid"] for loan in loans),
+            ("title",)
+        )
+
+    def location(self, loan):
+        """Return the transaction location of a loan."""
+        return current_location_cache.get(
+            loan["transaction_location_pid"]) or {}
+
+    def document(self, loan):
+        """Return the document of a loan."""
+        return self.documents.get(loan["document_pid"], {})
+
+
+def serialize_on_loan_book_information(loan, records):
     """Serialize loan information."""
-    location = Location.get_record_by_pid(loan["transaction_location_pid"])
-    document = Document.get_record_by_pid(loan["document_pid"])
+    location = records.location(loan)
+    document = records.document(loan)
     return dict(
         barcode=loan["item"]["barcode"],
         end_date=loan["end_date"],
-        library=location["name"],
-        location=location["address"],
-        title=document["title"]
+        library=location.get("name"),
+        location=location.get("address"),
+        title=document.get("title")
     )
 
 
-def serialize_loan_request_book_information(loan):
+def serialize_loan_request_book_information(loan, records):
     """Serialize loan information."""
-    location = Location.get_record_by_pid(loan["transaction_location_pid"])
-    document = Document.get_record_by_pid(loan["document_pid"])
+    location = records.location(loan)
+    document = records.document(loan)
     return dict(
         request_start_date=loan["start_date"],
         request_end_date=loan["end_date"],
-        library=location["name"],
-        location=location["address"],
-        title=document["title"]
+        library=location.get("name"),
+        location=location.get("address"),
+        title=document.get("title")
     )
 
 
@@ -44,15 +84,19 @@ def patron_loans_to_dict(patron_loans):
     :return: dict from patron's loan.
     :rtype: dict
     """
-    books_on_loan_results = patron_loans["active_loans"].hits.hits
+    books_on_loan_results = [
+        loan["_source"] for loan in patron_loans["active_loans"].hits.hits]
+    loan_requests_results = [
+        loan["_source"] for loan in patron_loans["pending_loans"].hits.hits]
+    records = LoanRecordsLoader(books_on_loan_results + loan_requests_results)
+
     books_on_loan = [
-        serialize_on_loan_book_information(
-            loan['_source']) for loan in books_on_loan_results]
+        serialize_on_loan_book_information(loan, records)
+        for loan in books_on_loan_results]
 
-    loan_requests_results = patron_loans["pending_loans"].hits.hits
     loan_requests = [
-        serialize_loan_request_book_information(
-            loan['_source']) for loan in loan_requests_results]
+        serialize_loan_request_book_information(loan, records)
+        for loan in loan_requests_results]
 
     response = dict(
         books_on_loan=books_on_loan,
@@ -10,26 +10,32 @@
 from copy import deepcopy
 from functools import wraps
 
+from elasticsearch_dsl import MultiSearch
 from flask import Blueprint, abort, current_app, jsonify
 from invenio_app_ils.circulation.views import need_permissions
 from invenio_app_ils.search.api import PatronsSearch
 from invenio_circulation.search.api import search_by_patron_item_or_document
 from invenio_rest import ContentNegotiatedMethodView
+from invenio_search import current_search_client
 
+from .proxies import current_patron_cache
 from .serializers import patron_loans_serializer
 
 
 def pass_patron_from_es():
-    """Decorator to retrieve a patron from ES."""
+    """Decorator to retrieve a patron from the cache or ES."""
     def pass_patron_decorator(f):
         @wraps(f)
         def inner(self, person_id, *args, **kwargs):
-            results = PatronsSearch().filter(
-                "term", person_id=person_id).execute()
-            if not len(results.hits.hits):
-                abort(404)
-            patron = results.hits.hits[0]["_source"]
-            return f(self, patron=patron.to_dict(), *args, **kwargs)
+            patron = current_patron_cache.get(person_id)
+            if patron is None:
+                results = PatronsSearch().filter(
+                    "term", person_id=person_id).execute()
+                if not len(results.hits.hits):
+                    abort(404)
+                patron = results.hits.hits[0]["_source"].to_dict()
+                current_patron_cache.set(person_id, patron)
+            return f(self, patron=patron, *args, **kwargs)
         return inner
     return pass_patron_decorator
 
@@ -70,12 +76,17 @@ class PatronLoansResource(ContentNegotiatedMethodView):
         """Retrieve patron loans."""
         active_loan_states = current_app.config[
             "CIRCULATION_STATES_LOAN_ACTIVE"]
-        active_loans = search_by_patron_item_or_document(
-            patron["id"], filter_states=active_loan_states).execute()
-
         pending_loan_states = ["PENDING"]
-        pending_loans = search_by_patron_item_or_document(
-            patron["id"], filter_states=pending_loan_states).execute()
+        # Both searches are sent in a single round-trip
+        active_loans, pending_loans = MultiSearch(
+            using=current_search_client
+        ).add(
+            search_by_patron_item_or_document(
+                patron["id"], filter_states=active_loan_states)
+        ).add(
+            search_by_patron_item_or_document(
+                patron["id"], filter_states=pending_loan_states)
+        ).execute()
 
         patron_loans = {
             "active_loans": active_loans,
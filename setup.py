@@ -44,6 +44,13 @@ setup(
             'migration = cds_books.migrator.cli:migration',
         ],
         'invenio_base.apps': [
+            'cds_books_patrons = cds_books.patrons.ext:CDSBooksPatrons',
+        ],
+        'invenio_base.api_apps': [
+            'cds_books_patrons = cds_books.patrons.ext:CDSBooksPatrons',
+        ],
+        'invenio_celery.tasks': [
+            'cds_books_ldap = cds_books.ldap.tasks',
         ],
         'invenio_base.blueprints': [
             'cds_books = cds_books.theme.views:blueprint',
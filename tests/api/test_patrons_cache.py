@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from invenio_app_ils.records.api import Location
+from invenio_db import db
+
+from cds_books.patrons.api import Patron
+from cds_books.patrons.indexer import PatronIndexer, bulk_index_patrons
+from cds_books.patrons.proxies import current_location_cache, \
+    current_patron_cache
+
+
+def test_location_cache(app, testdata):
+    """Test that the locations are cached and invalidated on updates."""
+    assert current_location_cache.get("locid-1")["name"] == "Main Library"
+    assert current_location_cache.get("unknown") is None
+
+    location = Location.get_record_by_pid("locid-1")
+    location["name"] = "Central Library"
+    location.commit()
+    # The cache is invalidated once the change is committed
+    assert current_location_cache.get("locid-1")["name"] == "Main Library"
+    db.session.commit()
+    assert current_location_cache.get("locid-1")["name"] == "Central Library"
+
+
+def test_patron_cache(app, db, es_clear, system_user):
+    """Test that indexing a patron invalidates its cached version."""
+    current_patron_cache.set(1, {"id": system_user.id, "person_id": "1"})
+    assert current_patron_cache.get("1")["id"] == system_user.id
+
+    bulk_index_patrons([system_user.id])
+    assert current_patron_cache.get(1) is None
+
+    current_patron_cache.set(1, {"id": system_user.id, "person_id": "1"})
+    PatronIndexer().index(Patron(system_user.id))
+    assert current_patron_cache.get(1) is None
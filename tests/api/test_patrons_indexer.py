@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from invenio_accounts.models import User
+from invenio_app_ils.search.api import PatronsSearch
+from invenio_search import current_search
+
+from cds_books.patrons.api import Patron
+from cds_books.patrons.indexer import bulk_index_all_patrons, \
+    bulk_index_patrons
+
+
+def test_bulk_index_patrons(app, db, es_clear, system_user):
+    """Test that only the given patrons are indexed."""
+    assert bulk_index_patrons([system_user.id]) == 1
+    current_search.flush_and_refresh(index='*')
+
+    hits = PatronsSearch().execute().hits
+    assert [hit.email for hit in hits] == [system_user.email]
+    assert bulk_index_patrons([]) == 0
+
+
+def test_bulk_index_all_patrons(app, db, es_clear, system_user):
+    """Test that the patrons of all the active users are indexed."""
+    db.session.add(User(email="deactivated@cern.ch", active=False))
+    db.session.commit()
+
+    assert bulk_index_all_patrons(chunk_size=1) == 1
+    current_search.flush_and_refresh(index='*')
+
+    hits = PatronsSearch().execute().hits
+    assert [hit.email for hit in hits] == [system_user.email]
+
+
+def test_get_patrons(app, db, system_user):
+    """Test that the patrons are loaded with their remote accounts."""
+    patrons = Patron.get_patrons([system_user.id])
+    assert [patron.id for patron in patrons] == [system_user.id]
+    assert patrons[0].dumps()["person_id"] == "1"
+    assert patrons[0].dumps() == Patron(system_user.id).dumps()
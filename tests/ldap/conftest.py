@@ -9,11 +9,95 @@
 
 from __future__ import absolute_import, print_function
 
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
 import pytest
 from invenio_app.factory import create_app as _create_app
+from invenio_cache import current_cache
+from sqlalchemy import event
+
+from cds_books.ldap.pool import close_pools
+from cds_books.ldap.snapshot import SNAPSHOT_KEY
+from cds_books.ldap.sync import SYNC_LOCK_KEY, SYNC_STATE_KEY
+from cds_books.ldap.testutils import FakeLdapDirectory
 
 
 @pytest.fixture(scope="module")
 def create_app():
     """Create test app."""
     return _create_app
+
+
+def clear_sync_keys():
+    """Forget the snapshot, sync state and lock of previous syncs."""
+    current_cache.delete_many(SNAPSHOT_KEY, SYNC_STATE_KEY, SYNC_LOCK_KEY)
+
+
+@pytest.fixture()
+def ldap_directory(app):
+    """Target an in-process ldap directory of 100 users."""
+    directory = FakeLdapDirectory(users=100)
+    config = app.config
+    previous = config.get("CDS_BOOKS_LDAP_CONNECTION_FACTORY")
+    config.update(CDS_BOOKS_LDAP_CONNECTION_FACTORY=directory)
+    clear_sync_keys()
+    close_pools()
+    yield directory
+    close_pools()
+    clear_sync_keys()
+    config.update(CDS_BOOKS_LDAP_CONNECTION_FACTORY=previous)
+
+
+class LdapBenchmarkResults(object):
+    """Collect the time, database queries and memory of ldap commands."""
+
+    def __init__(self):
+        """Constructor."""
+        self.results = []
+
+    @contextmanager
+    def measure(self, name, users, engine):
+        """Measure the wrapped step processing the given number of users."""
+        queries = []
+
+        def count_query(*args, **kwargs):
+            queries.append(1)
+
+        event.listen(engine, "before_cursor_execute", count_query)
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            event.remove(engine, "before_cursor_execute", count_query)
+        self.results.append(dict(
+            name=name,
+            users=users,
+            seconds=elapsed,
+            queries=len(queries),
+            peak_memory_kb=peak // 1024,
+        ))
+
+    def dump(self, path=None):
+        """Write the results to the given path or print them."""
+        report = json.dumps(self.results, indent=2)
+        if path:
+            with open(path, 'w') as fp:
+                fp.write(report)
+        else:
+            print(report)
+
+
+@pytest.fixture(scope="session")
+def ldap_benchmark_results():
+    """Benchmark results, reported at the end of the session."""
+    results = LdapBenchmarkResults()
+    yield results
+    results.dump(os.environ.get('CDS_BOOKS_LDAP_BENCHMARKS_OUTPUT'))
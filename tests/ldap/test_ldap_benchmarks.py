@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Ldap users import and sync benchmarks on a fake ldap directory.
+
+The benchmarks are skipped unless ``CDS_BOOKS_BENCHMARKS`` is set, e.g.::
+
+    CDS_BOOKS_BENCHMARKS=1 CDS_BOOKS_BENCHMARK_LDAP_USERS=10000,100000 \\
+    CDS_BOOKS_LDAP_BENCHMARKS_OUTPUT=ldap.json pytest tests/ldap
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+
+from cds_books.ldap.cli import ldap_users
+from cds_books.ldap.pool import close_pools
+from cds_books.ldap.testutils import FakeLdapDirectory
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('CDS_BOOKS_BENCHMARKS'),
+    reason='Set CDS_BOOKS_BENCHMARKS to run the ldap benchmarks.'
+)
+
+USERS = [
+    int(users) for users in
+    os.environ.get('CDS_BOOKS_BENCHMARK_LDAP_USERS', '10000').split(',')
+]
+LATENCY = float(os.environ.get('CDS_BOOKS_BENCHMARK_LDAP_LATENCY', 0.005))
+
+
+@pytest.mark.parametrize('users', USERS)
+def test_ldap_users_benchmark(app, db, es_clear, ldap_directory,
+                              ldap_benchmark_results, users):
+    """Benchmark the import and a full sync changing 1% of the users."""
+    directory = FakeLdapDirectory(users=users, latency=LATENCY)
+    app.config['CDS_BOOKS_LDAP_CONNECTION_FACTORY'] = directory
+    close_pools()
+    runner = app.test_cli_runner()
+
+    with ldap_benchmark_results.measure('import', users, db.engine):
+        result = runner.invoke(ldap_users, ['import'])
+    assert result.exit_code == 0, result.output
+
+    for person_id in range(1, users + 1, 100):
+        directory.modify(person_id, department='TH')
+
+    with ldap_benchmark_results.measure('sync', users, db.engine):
+        result = runner.invoke(ldap_users, ['sync'])
+    assert result.exit_code == 0, result.output
@@ -7,48 +7,203 @@
 
 from __future__ import absolute_import, print_function
 
+import json
+
+import click
 import pytest
 from invenio_accounts.models import User
 from invenio_oauthclient.models import RemoteAccount, UserIdentity
 from invenio_userprofiles.models import UserProfile
 
-from cds_books.ldap.cli import check_user_for_update, import_ldap_users
+from cds_books.ldap.api import DEACTIVATED_IDENTITY_METHOD, LdapClient, \
+    LdapUser
+from cds_books.ldap.cli import check_deactivation_ratio, \
+    deactivate_ldap_users, import_ldap_users, ldap_users, update_ldap_users
 
 
-def test_check_users_for_update(app, system_user):
-    """Test check for users update in sync command."""
-    with app.app_context():
-        user = RemoteAccount.query.join(User).one()
-        ldap_user = {
-            'displayName': [b'System User'],
-            'department': [b'Another department'],
-            'uidNumber': [b'1'],
-            'mail': [b'system.user@cern.ch'],
-            'cernAccountType': [b'Primary'],
-            'employeeID': [b'1']
-        }
-        check_user_for_update(user, ldap_user)
-        assert user.extra_data["department"] == "Another department"
+def test_update_ldap_users(app, system_user, es_clear):
+    """Test that only the changed fields of a user are updated."""
+    ldap_user = LdapUser.from_entry({
+        'displayName': [b'System User'],
+        'department': [b'Another department'],
+        'uidNumber': [b'2'],
+        'mail': [b'system_user@cern.ch'],
+        'cernAccountType': [b'Primary'],
+        'employeeID': [b'1']
+    })
+    update_ldap_users(
+        [(system_user.id, ldap_user, ("department", "uid_number"))])
+
+    remote_account = RemoteAccount.query.filter(
+        RemoteAccount.user_id == system_user.id).one()
+    assert remote_account.extra_data["department"] == "Another department"
+    assert remote_account.extra_data["person_id"] == "1"
+    assert UserIdentity.query.filter(
+        UserIdentity.id_user == system_user.id).one().id == "2"
 
 
-def test_import_ldap_users(app):
+def test_import_ldap_users(app, db, es_clear):
     """Test that ldap user is created."""
-    ldap_users = [{
+    ldap_users = [LdapUser.from_entry({
         'displayName': [b'Ldap User'],
         'department': [b'Department'],
         'uidNumber': [b'1'],
         'mail': [b'ldap.user@cern.ch'],
         'cernAccountType': [b'Primary'],
         'employeeID': [b'1']
-    }]
+    })]
 
     import_ldap_users(ldap_users)
 
-    user = User.query.filter(
-        User.email == ldap_users[0]["mail"][0].decode("utf8")).one()
+    user = User.query.filter(User.email == ldap_users[0].mail).one()
     assert user
 
     assert UserProfile.query.filter(UserProfile.user_id == user.id).one()
     assert UserIdentity.query.filter(
-        UserIdentity.id == ldap_users[0]["uidNumber"][0].decode("utf8")).one()
+        UserIdentity.id == ldap_users[0].uid_number).one()
     assert RemoteAccount.query.filter(RemoteAccount.user_id == user.id).one()
+
+
+def test_ldap_user_from_entry():
+    """Test that ldap entries are decoded once."""
+    ldap_user = LdapUser.from_entry({
+        'displayName': [b'Ldap User'],
+        'department': [b'IT/CDA'],
+        'uidNumber': [b'1'],
+        'mail': [b'ldap.user@cern.ch'],
+        'cernAccountType': [b'Primary'],
+        'employeeID': [b'1']
+    })
+    assert ldap_user.person_id == "1"
+    assert ldap_user.mail == "ldap.user@cern.ch"
+    assert ldap_user.display_name == "Ldap User"
+    assert ldap_user.department == "IT/CDA"
+    assert ldap_user.uid_number == "1"
+    assert ldap_user.account_type == "Primary"
+    assert LdapUser.from_entry({'employeeID': [b'2']}).mail is None
+
+    same = LdapUser(**ldap_user.to_dict())
+    assert same == ldap_user
+    assert {ldap_user: 1}[same] == 1
+    assert len({ldap_user, same, LdapUser(**dict(
+        ldap_user.to_dict(), department="TH"))}) == 2
+
+
+def test_deactivate_ldap_users(app, system_user, es_clear):
+    """Test that users removed from ldap are deactivated."""
+    deactivate_ldap_users([(system_user.id, "1")])
+
+    assert not User.query.get(system_user.id).active
+    remote_account = RemoteAccount.query.filter(
+        RemoteAccount.user_id == system_user.id).one()
+    assert remote_account.extra_data["deactivated_at"]
+    assert UserIdentity.query.filter(
+        UserIdentity.id_user == system_user.id).one().method == \
+        DEACTIVATED_IDENTITY_METHOD
+
+    with pytest.raises(click.ClickException):
+        check_deactivation_ratio([(1, "1"), (2, "2")], 10)
+    check_deactivation_ratio([(1, "1")], 100)
+
+
+def test_sync_ldap_users(app, db, es_clear, ldap_directory):
+    """Test that the sync applies the ldap changes."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(ldap_users, ["import"])
+    assert result.exit_code == 0, result.output
+    assert User.query.count() == 100
+
+    ldap_directory.modify("1", mail="new.user1@cern.ch")
+    ldap_directory.remove("2")
+    ldap_directory.add(**ldap_directory.user_attributes(101))
+
+    result = runner.invoke(ldap_users, ["sync", "--quiet"])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output.splitlines()[-1])
+    assert report["success"]
+    assert report["counts"]["added"] == 1
+    assert report["counts"]["updated"] == 1
+    assert report["counts"]["removed"] == 1
+
+    assert User.query.filter(User.email == "new.user1@cern.ch").one()
+    assert not User.query.filter(
+        User.email == "user2@cern.ch").one().active
+    assert User.query.filter(User.email == "user101@cern.ch").one()
+
+
+def test_index_users(app, db, es_clear, ldap_directory):
+    """Test that all the patrons are reindexed."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(ldap_users, ["import"])
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(ldap_users, ["index"])
+    assert result.exit_code == 0, result.output
+    assert "Patrons indexed 100" in result.output
+
+
+def test_sync_reactivated_users(app, db, es_clear, ldap_directory):
+    """Test that users back in ldap are reactivated."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(ldap_users, ["import"])
+    assert result.exit_code == 0, result.output
+    user_id = User.query.filter(User.email == "user2@cern.ch").one().id
+
+    ldap_directory.remove("2")
+    result = runner.invoke(ldap_users, ["sync"])
+    assert result.exit_code == 0, result.output
+    assert not User.query.get(user_id).active
+
+    ldap_directory.add(**ldap_directory.user_attributes(2))
+    result = runner.invoke(ldap_users, ["sync", "--quiet"])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output.splitlines()[-1])
+    assert report["counts"]["reactivated"] == 1
+    assert report["counts"]["added"] == 0
+
+    assert User.query.get(user_id).active
+    remote_account = RemoteAccount.query.filter(
+        RemoteAccount.user_id == user_id).one()
+    assert "deactivated_at" not in remote_account.extra_data
+    identity = UserIdentity.query.filter(
+        UserIdentity.id_user == user_id).one()
+    assert identity.method == "cern"
+    assert identity.id == ldap_directory.user_attributes(2)["uidNumber"]
+
+
+def test_sync_existing_users(app, db, es_clear, ldap_directory):
+    """Test that users created outside the sync are synchronized."""
+    runner = app.test_cli_runner()
+    for command in (["import"], ["sync"]):
+        result = runner.invoke(ldap_users, command)
+        assert result.exit_code == 0, result.output
+
+    # Imported after the snapshot was saved, then changed in ldap
+    ldap_directory.add(**ldap_directory.user_attributes(101))
+    ldap_user, = LdapClient(
+        app.config["CDS_BOOKS_LDAP_URL"]).get_user_by_person_id("101")
+    import_ldap_users([ldap_user])
+    ldap_directory.modify("101", department="TH")
+    # Logged in with SSO, without remote account, profile nor identity
+    ldap_directory.add(**ldap_directory.user_attributes(102))
+    db.session.add(User(email="user102@cern.ch", active=True))
+    db.session.commit()
+
+    for updated in (2, 0):
+        result = runner.invoke(ldap_users, ["sync", "--quiet"])
+        assert result.exit_code == 0, result.output
+        report = json.loads(result.output.splitlines()[-1])
+        assert report["counts"]["added"] == 0
+        assert report["counts"]["updated"] == updated
+
+    user_id = User.query.filter(User.email == "user102@cern.ch").one().id
+    remote_account = RemoteAccount.query.filter(
+        RemoteAccount.user_id == user_id).one()
+    assert remote_account.extra_data["person_id"] == "102"
+    assert UserProfile.query.get(user_id).full_name == "User 102"
+    assert UserIdentity.query.filter(
+        UserIdentity.id_user == user_id).one().id == "100102"
+    user_id = User.query.filter(User.email == "user101@cern.ch").one().id
+    assert RemoteAccount.query.filter(
+        RemoteAccount.user_id == user_id).one().extra_data["department"] == \
+        "TH"
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from datetime import datetime
+
+import ldap
+import pytest
+from ldap.controls import SimplePagedResultsControl
+
+from cds_books.ldap.api import LdapClient
+
+
+def test_get_primary_accounts(app, ldap_directory):
+    """Test the paged, partitioned and incremental exports."""
+    client = LdapClient(app.config["CDS_BOOKS_LDAP_URL"], page_size=10)
+
+    ldap_users = list(client.get_primary_accounts(partitions=[]))
+    assert len(ldap_users) == 100
+    assert client.pages == 10
+
+    partitioned = list(client.get_primary_accounts(partitions=["1", "2"]))
+    assert sorted(u.person_id for u in partitioned) == \
+        sorted(u.person_id for u in ldap_users)
+
+    ldap_directory.modify("7", department="TH")
+    modified = list(client.get_primary_accounts(
+        modified_since=datetime(2019, 6, 1)))
+    assert [(u.person_id, u.department) for u in modified] == [("7", "TH")]
+
+
+def test_paged_search_restarts_after_disconnect(app, ldap_directory):
+    """Test that an export restarts on a new connection after a drop."""
+    app.config["CDS_BOOKS_LDAP_RETRY_DELAY"] = 0
+    client = LdapClient(app.config["CDS_BOOKS_LDAP_URL"], page_size=10)
+
+    ldap_directory.disconnect(after=3, times=2)
+    ldap_users = list(client.get_primary_accounts(partitions=[]))
+    assert len(set(u.person_id for u in ldap_users)) == len(ldap_users) == 100
+    # The 3 pages read before the drop are fetched again
+    assert client.pages == 13
+
+    ldap_directory.disconnect(after=3, times=client.pool.retry_max + 1)
+    with pytest.raises(ldap.SERVER_DOWN):
+        list(client.get_primary_accounts(partitions=[]))
+
+
+def test_accounts_without_mail_are_skipped(app, ldap_directory):
+    """Test that the accounts without email are not exported."""
+    attributes = ldap_directory.user_attributes(101)
+    del attributes["mail"]
+    ldap_directory.add(**attributes)
+    client = LdapClient(app.config["CDS_BOOKS_LDAP_URL"])
+
+    ldap_users = list(client.get_primary_accounts())
+    assert len(ldap_users) == 100
+    assert client.skipped == 1
+    assert client.get_users_by_person_ids(["101"]) == {"101": None}
+
+
+def test_paged_search_cookie_bound_to_connection(ldap_directory):
+    """Test that the fake rejects a cookie from another connection."""
+    first = ldap_directory("ldap://fake")
+    second = ldap_directory("ldap://fake")
+    page_control = SimplePagedResultsControl(True, size=10, cookie='')
+    msgid = first.search_ext(
+        "", ldap.SCOPE_ONELEVEL, "(cernAccountType=Primary)",
+        serverctrls=[page_control])
+    page_control.cookie = first.result3(msgid)[3][0].cookie
+    msgid = second.search_ext(
+        "", ldap.SCOPE_ONELEVEL, "(cernAccountType=Primary)",
+        serverctrls=[page_control])
+    with pytest.raises(ldap.UNWILLING_TO_PERFORM):
+        second.result3(msgid)
+
+
+def test_get_users_by_person_ids(app, ldap_directory):
+    """Test the batch lookups."""
+    client = LdapClient(app.config["CDS_BOOKS_LDAP_URL"])
+    found = client.get_users_by_person_ids(["1", "2", "1000"])
+    assert found["1"].mail == "user1@cern.ch"
+    assert found["2"].mail == "user2@cern.ch"
+    assert found["1000"] is None
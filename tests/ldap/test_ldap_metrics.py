@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from cds_books.ldap.metrics import LdapRunMetrics
+
+
+def test_ldap_run_metrics(tmpdir):
+    """Test the nested timers and the metrics reports."""
+    metrics = LdapRunMetrics()
+    metrics.reset('sync')
+    with metrics.timer('db'):
+        for _ in metrics.timed_iter('ldap_fetch', range(3),
+                                    counter='ldap_entries'):
+            pass
+    metrics.count('updated', 2)
+    metrics.success = True
+
+    report = metrics.report()
+    assert report['command'] == 'sync'
+    assert report['counts']['ldap_entries'] == 3
+    assert report['counts']['updated'] == 2
+    assert report['seconds']['db'] + report['seconds']['ldap_fetch'] <= \
+        report['total_seconds']
+
+    path = str(tmpdir.join('ldap.prom'))
+    metrics.write_prometheus(path)
+    with open(path) as fp:
+        lines = fp.read().splitlines()
+    assert 'cds_books_ldap_users_success{command="sync"} 1' in lines
+    assert 'cds_books_ldap_users_items{command="sync",kind="updated"} 2' \
+        in lines
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from invenio_oauthclient.models import RemoteAccount
+
+from cds_books.ldap.api import LdapUser
+from cds_books.ldap.snapshot import LdapSnapshot, diff_ldap_users
+
+
+def ldap_user(person_id, department="Department", mail=None):
+    """Return an ldap account."""
+    return LdapUser(
+        person_id=person_id,
+        mail=mail or "user{}@cern.ch".format(person_id),
+        display_name="User {}".format(person_id),
+        department=department,
+        uid_number=person_id,
+    )
+
+
+def test_diff_ldap_users(app, ldap_directory):
+    """Test that only the changed accounts are reported."""
+    snapshot = LdapSnapshot()
+    for person_id in ("1", "2", "3"):
+        snapshot.add(int(person_id), ldap_user(person_id))
+    snapshot.save()
+    snapshot = LdapSnapshot.load()
+    assert len(snapshot) == 3
+
+    ldap_users = [
+        ldap_user("1"),
+        ldap_user("2", department="IT", mail="new@cern.ch"),
+        ldap_user("4"),
+    ]
+    diff = diff_ldap_users(snapshot, ldap_users)
+    assert diff.added == [ldap_users[2]]
+    assert diff.updated == [(2, ldap_users[1], ("department", "mail"))]
+    assert diff.removed == [(3, "3")]
+
+    diff = diff_ldap_users(snapshot, ldap_users, full=False)
+    assert diff.removed == []
+    assert len(diff) == 2
+
+
+def test_ldap_snapshot_from_db(app, db, system_user):
+    """Test that the snapshot is built from the system users."""
+    # Accounts of other OAuth clients are ignored
+    db.session.add(RemoteAccount(
+        client_id="OTHER_CLIENT_ID", user_id=system_user.id,
+        extra_data=dict(person_id="2")))
+    db.session.commit()
+
+    snapshot = LdapSnapshot.from_db()
+    assert snapshot.user_id("1") == system_user.id
+    assert "2" not in snapshot
+
+    same = LdapUser(
+        person_id="1",
+        mail="system_user@cern.ch",
+        display_name="System User",
+        department="Department",
+        uid_number="1",
+    )
+    assert len(diff_ldap_users(snapshot, [same])) == 0
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from cds_books.ldap.sync import LdapSyncLocked, LdapSyncState, \
+    acquire_sync_lock, ldap_timestamp, release_sync_lock, sync_lock
+
+
+def test_ldap_sync_state(app, ldap_directory):
+    """Test the incremental sync high-water marks."""
+    day = timedelta(days=1)
+    now = datetime(2019, 10, 1, 12, 0, 0)
+
+    state = LdapSyncState.load()
+    assert state.needs_full_sync(now, day)
+
+    state.mark_synced(now, full=True)
+    state.save()
+    state = LdapSyncState.load()
+    assert state.last_full_sync == now
+    assert not state.needs_full_sync(now + timedelta(hours=1), day)
+    assert state.needs_full_sync(now + day, day)
+
+    later = now + timedelta(hours=1)
+    state.mark_synced(later, full=False)
+    assert state.last_full_sync == now
+    modified_since = state.modified_since(timedelta(minutes=5))
+    assert ldap_timestamp(modified_since) == "20191001125500Z"
+
+
+def test_ldap_sync_lock(app, ldap_directory):
+    """Test that a single synchronization runs at a time."""
+    with sync_lock():
+        with pytest.raises(LdapSyncLocked):
+            acquire_sync_lock()
+    token = acquire_sync_lock()
+    # A stale token does not release the lock of another sync
+    release_sync_lock("stale")
+    with pytest.raises(LdapSyncLocked):
+        acquire_sync_lock()
+    release_sync_lock(token)
+    release_sync_lock(acquire_sync_lock())
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from invenio_accounts.models import User
+
+from cds_books.ldap.cli import ldap_users
+from cds_books.ldap.sync import LdapSyncLocked, LdapSyncState, sync_lock
+from cds_books.ldap.tasks import sync_users
+
+
+def test_sync_users_task(app, db, es_clear, ldap_directory):
+    """Test the chunked asynchronous sync."""
+    app.config["CDS_BOOKS_LDAP_TASK_CHUNK_SIZE"] = 2
+    result = app.test_cli_runner().invoke(ldap_users, ["import"])
+    assert result.exit_code == 0, result.output
+
+    for person_id in ("1", "2", "3"):
+        ldap_directory.modify(person_id, department="TH")
+    ldap_directory.add(**ldap_directory.user_attributes(101))
+
+    meta = sync_users.delay(incremental=False).get()
+    assert meta["updated"] == 3
+    assert meta["added"] == 1
+    assert meta["chunks"] == 3
+
+    assert User.query.filter(User.email == "user101@cern.ch").one()
+    assert LdapSyncState.load().last_full_sync
+
+    meta = sync_users.delay(incremental=False).get()
+    assert meta["chunks"] == 0
+
+
+def test_sync_users_locked(app, db, es_clear, ldap_directory):
+    """Test that a sync does not start while another one is running."""
+    with sync_lock():
+        with pytest.raises(LdapSyncLocked):
+            sync_users.delay(incremental=False).get()
+        result = app.test_cli_runner().invoke(ldap_users, ["sync"])
+        assert result.exit_code == 1
+        assert "Another ldap synchronization is running" in result.output
+    assert not User.query.count()
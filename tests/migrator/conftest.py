@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Pytest fixtures and plugins for the migrator benchmarks."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+import pytest
+from invenio_app.factory import create_app as _create_app
+
+from cds_books.migrator.profiling import profiler
+
+
+class BenchmarkResults(object):
+    """Collect the throughput and memory usage of benchmarked steps."""
+
+    def __init__(self):
+        """Constructor."""
+        self.results = []
+
+    @contextmanager
+    def measure(self, name, records):
+        """Measure the wrapped step processing the given number of records."""
+        profiler.reset()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.results.append(dict(
+            name=name,
+            records=records,
+            seconds=elapsed,
+            records_per_second=records / elapsed if elapsed else None,
+            # kilobytes on Linux, peak of the whole benchmark process so far
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            stages=profiler.report()['stages'],
+        ))
+
+    def dump(self, path=None):
+        """Write the results to the given path or print them."""
+        report = json.dumps(self.results, indent=2)
+        if path:
+            with open(path, 'w') as fp:
+                fp.write(report)
+        else:
+            print(report)
+
+
+@pytest.fixture(scope="module")
+def create_app():
+    """Create test app."""
+    return _create_app
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    """Benchmark results, reported at the end of the session."""
+    results = BenchmarkResults()
+    yield results
+    results.dump(os.environ.get('CDS_BOOKS_BENCHMARKS_OUTPUT'))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Migration benchmarks on synthetic CDS dumps.
+
+The benchmarks are skipped unless ``CDS_BOOKS_BENCHMARKS`` is set, e.g.::
+
+    CDS_BOOKS_BENCHMARKS=1 CDS_BOOKS_BENCHMARK_DOCUMENTS=10000 \\
+    CDS_BOOKS_BENCHMARKS_OUTPUT=bench.json pytest tests/migrator
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+from invenio_search import current_search
+
+from cds_books.migrator.api import import_documents_from_dump, \
+    import_parents_from_file, link_and_create_multipart_volumes, \
+    link_documents_and_serials, reindex_pidtype
+from cds_books.migrator.testutils import DumpGenerator
+from cds_books.migrator.validation import validate_multiparts, \
+    validate_serials
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('CDS_BOOKS_BENCHMARKS'),
+    reason='Set CDS_BOOKS_BENCHMARKS to run the migration benchmarks.'
+)
+
+DOCUMENTS = int(os.environ.get('CDS_BOOKS_BENCHMARK_DOCUMENTS', 1000))
+SOURCE_TYPE = os.environ.get('CDS_BOOKS_BENCHMARK_SOURCE_TYPE', 'json')
+
+
+def test_migration_benchmark(app, db, es_clear, tmpdir, benchmark_results):
+    """Benchmark the whole migration of a synthetic dump."""
+    generator = DumpGenerator(
+        documents=DOCUMENTS,
+        serials=max(DOCUMENTS // 20, 1),
+        multiparts=max(DOCUMENTS // 20, 1),
+    )
+    paths = generator.write(str(tmpdir))
+    serials = [
+        title for title, children in generator.serial_children.items()
+        if children
+    ]
+    refresh = current_search.flush_and_refresh
+
+    with benchmark_results.measure('documents', generator.documents):
+        with open(paths['documents']) as source:
+            import_documents_from_dump(
+                [source], source_type=SOURCE_TYPE, eager=True, include=None)
+        db.session.commit()
+    refresh(index='*')
+
+    parents = dict(
+        serial=len(serials),
+        multipart=len(generator.multipart_recids),
+    )
+    for rectype, records in parents.items():
+        with benchmark_results.measure('parents_' + rectype, records):
+            with open(paths['{}s'.format(rectype)]) as source:
+                import_parents_from_file(source, rectype, include=None)
+            db.session.commit()
+    refresh(index='*')
+
+    with benchmark_results.measure(
+            'relations_multipart', parents['multipart']):
+        link_and_create_multipart_volumes()
+        db.session.commit()
+        reindex_pidtype('docid')
+        reindex_pidtype('serid')
+    refresh(index='*')
+    with benchmark_results.measure(
+            'relations_serial', len(generator.document_serials)):
+        link_documents_and_serials()
+        db.session.commit()
+        reindex_pidtype('docid')
+        reindex_pidtype('serid')
+    refresh(index='*')
+
+    with benchmark_results.measure('validate_serial', parents['serial']):
+        serial_report = validate_serials()
+    with benchmark_results.measure(
+            'validate_multipart', parents['multipart']):
+        multipart_report = validate_multiparts()
+
+    assert serial_report['checked'] == parents['serial']
+    assert not serial_report['errors']
+    assert multipart_report['checked'] == parents['multipart']
+    assert not multipart_report['errors']
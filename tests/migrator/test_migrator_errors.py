@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from cds_books.migrator.cli import summary
+from cds_books.migrator.handlers import JSONLErrorSink, summarize_errors
+
+
+class BrokenFile(object):
+    """File failing on every write."""
+
+    def write(self, data):
+        """Fail to write."""
+        raise IOError('No space left on device')
+
+    def flush(self):
+        """Flush nothing."""
+
+    def close(self):
+        """Close nothing."""
+
+
+def write_errors(path, errors):
+    """Write errors with a new sink."""
+    sink = JSONLErrorSink(batch_size=2, max_pending=3)
+    sink.open(path)
+    for error in errors:
+        sink.put(*error)
+    sink.close()
+
+
+def test_error_sink(tmpdir):
+    """Test that the errors are written once per run."""
+    path = str(tmpdir.join('errors.jsonl'))
+    errors = [
+        (1, '020__', 'UnexpectedValue', 'Invalid ISBN', 'abc'),
+        (1, '260__', 'MissingRequiredField', 'No date', None),
+        (2, '020__', 'UnexpectedValue', 'Invalid ISBN', 'def'),
+    ]
+    write_errors(path, errors * 10)
+    with open(path) as fp:
+        lines = fp.read().splitlines()
+    assert len(lines) == 30
+    assert json.loads(lines[0]) == dict(
+        recid=1, field='020__', error='UnexpectedValue',
+        message='Invalid ISBN', value='abc')
+
+    # A rerun replaces the errors of the previous one
+    write_errors(path, errors)
+    with open(path) as fp:
+        assert summarize_errors(fp) == [
+            ('020__', 'UnexpectedValue', 2, 2),
+            ('260__', 'MissingRequiredField', 1, 1),
+        ]
+
+
+def test_error_sink_unwritable_path(tmpdir):
+    """Test that an unwritable path fails when the sink is opened."""
+    sink = JSONLErrorSink()
+    with pytest.raises(IOError):
+        sink.open(str(tmpdir.join('missing', 'errors.jsonl')))
+    assert not sink.is_open
+
+
+def test_error_sink_write_error(tmpdir):
+    """Test that a write error is raised when the sink is closed."""
+    sink = JSONLErrorSink(batch_size=2, max_pending=2)
+    sink.open(str(tmpdir.join('errors.jsonl')))
+    sink._fp.close()
+    sink._fp = BrokenFile()
+    # The writer keeps draining the bounded queue after the error
+    for recid in range(100):
+        sink.put(recid, '020__', 'UnexpectedValue', 'Invalid ISBN', 'abc')
+    with pytest.raises(IOError):
+        sink.close()
+    assert not sink.is_open
+
+
+def test_errors_summary_command(tmpdir):
+    """Test the errors summary command."""
+    path = str(tmpdir.join('errors.jsonl'))
+    write_errors(path, [
+        (1, '020__', 'UnexpectedValue', 'Invalid ISBN', 'abc'),
+        (2, '020__', 'UnexpectedValue', 'Invalid ISBN', 'def'),
+        (2, '020__', 'UnexpectedValue', 'Invalid ISBN', 'ghi'),
+    ])
+    runner = CliRunner()
+
+    result = runner.invoke(summary, [path, '--json'])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == [dict(
+        field='020__', error='UnexpectedValue', count=3, records=2)]
+
+    result = runner.invoke(summary, [path])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1].split() == \
+        ['020__', 'UnexpectedValue', '3', '2']
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cds_books.migrator import profiling
+from cds_books.migrator.profiling import StageProfiler, percentile
+
+
+class FakeClock(object):
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        """Constructor."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    """Replace the profiler clock."""
+    clock = FakeClock()
+    monkeypatch.setattr(profiling.time, 'perf_counter', clock)
+    return clock
+
+
+def test_percentile():
+    """Test the nearest-rank percentiles."""
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+
+
+def test_stage_profiler_samples_per_record(clock):
+    """Test that each stage is sampled once per record."""
+    profiler = StageProfiler()
+    for seconds in (1.0, 3.0):
+        with profiler.record():
+            # Two revisions parsed, two creations for the same record
+            for _ in range(2):
+                with profiler.stage('marc_parse'):
+                    clock.now += seconds
+                with profiler.stage('record_create'):
+                    clock.now += 0.5
+    with profiler.stage('indexing'):
+        clock.now += 2.0
+
+    report = profiler.report()
+    assert report['records'] == 2
+    assert report['elapsed_seconds'] == 12.0
+    assert list(report['stages']) == ['marc_parse', 'record_create',
+                                      'indexing']
+
+    marc_parse = report['stages']['marc_parse']
+    assert marc_parse['records'] == 2
+    assert marc_parse['total_seconds'] == 8.0
+    assert marc_parse['p50'] == 2.0
+    assert marc_parse['p99'] == 6.0
+    assert marc_parse['records_per_second'] == 0.25
+
+    record_create = report['stages']['record_create']
+    assert record_create['records'] == 2
+    assert record_create['p50'] == record_create['p99'] == 1.0
+
+    indexing = report['stages']['indexing']
+    assert indexing['total_seconds'] == 2.0
+    assert indexing['records'] == 0
+    assert indexing['p50'] is None
+    assert indexing['records_per_second'] is None
+
+    assert profiler.summary_line() == \
+        '0.2 rec/s marc_parse=8.0s record_create=2.0s indexing=2.0s'
+
+
+def test_stage_profiler_failed_record(clock):
+    """Test that a failed record is not sampled."""
+    profiler = StageProfiler()
+    with pytest.raises(ValueError):
+        with profiler.record():
+            with profiler.stage('dojson'):
+                clock.now += 1.0
+                raise ValueError()
+
+    report = profiler.report()
+    assert report['records'] == 0
+    assert report['stages']['dojson']['total_seconds'] == 1.0
+    assert report['stages']['dojson']['records'] == 0
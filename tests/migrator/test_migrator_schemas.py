@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 CERN.
+#
+# CDS Books is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from invenio_app_ils.pidstore.providers import SeriesIdProvider
+from invenio_app_ils.records.api import Series
+from invenio_jsonschemas import current_jsonschemas
+from jsonschema.exceptions import ValidationError
+
+from cds_books.migrator.api import import_record, prevalidate_dumps
+from cds_books.migrator.schemas import CachedSchemaValidator, \
+    PrevalidatedValidator, clear_validators
+
+
+def serial(title):
+    """Return a serial dump."""
+    return {
+        'title': {'title': title},
+        'mode_of_issuance': 'SERIAL',
+        '_migration': {'children': [1]},
+    }
+
+
+@pytest.fixture()
+def schema_loads(app, monkeypatch):
+    """Record the JSON schemas loaded from invenio-jsonschemas."""
+    loads = []
+    jsonschemas = current_jsonschemas._get_current_object()
+    get_schema = jsonschemas.get_schema
+
+    def counting_get_schema(path, *args, **kwargs):
+        loads.append(path)
+        return get_schema(path, *args, **kwargs)
+
+    monkeypatch.setattr(jsonschemas, 'get_schema', counting_get_schema)
+    clear_validators()
+    yield loads
+    clear_validators()
+
+
+def test_cached_schema_validation(app, db, schema_loads):
+    """Test that the schema is resolved once for all the records."""
+    for title in ('First', 'Second', 'Third'):
+        import_record(
+            serial(title), Series, SeriesIdProvider, CachedSchemaValidator)
+    assert len(schema_loads) == 1
+
+    with pytest.raises(ValidationError):
+        import_record(dict(serial('Invalid'), title=42), Series,
+                      SeriesIdProvider, CachedSchemaValidator)
+    assert len(schema_loads) == 1
+
+
+def test_deferred_validation(app, db, schema_loads):
+    """Test that no validation happens on insertion in deferred mode."""
+    dumps = [serial('Valid'), dict(serial('Invalid'), title=42)]
+    valid = prevalidate_dumps(dumps, Series, workers=1)
+    assert valid == dumps[:1]
+    assert len(schema_loads) == 1
+
+    del schema_loads[:]
+    # The records are trusted to be valid, even an invalid one is inserted
+    record = import_record(
+        dumps[1], Series, SeriesIdProvider, PrevalidatedValidator)
+    assert record['title'] == 42
+    assert schema_loads == []